@@ -5,6 +5,7 @@
 read -p "Please select what you want to run:
 1. Run API Tests
 2. Run Command Line Rules-Based Tests
+3. Run Command Line Rules-Based Benchmarks
 
 Enter the corresponding number: " number
 
@@ -23,6 +24,13 @@ case $number in
         cd "$(dirname "$0")/tools/tests"
         bash run_test.sh
         ;;
+    3)
+        # Command for number 3
+        echo "Running Command Line Rules-Based Benchmarks..."
+        cd "$(dirname "$0")/tools"
+        source .venv/bin/activate
+        python3 tests/run_benchmark.py
+        ;;
     *)
         # Default case when the input is not recognized
         echo "Invalid input"
@@ -17,25 +17,48 @@
 # load ctransformers and set up parameters
 from ctransformers import AutoModelForCausalLM
 
-# try loading model
-try:
-    llm = AutoModelForCausalLM.from_pretrained(
-        model_path_or_repo_id="./models/13B-chat-GGUF-q5_K_M.gguf",
-        model_file="13B-chat-GGUF-q5_K_M.gguf",
-        model_type="llama",
-        max_new_tokens=75,
-        repetition_penalty=1.2,
-        temperature=0.25,
-        top_p=0.95,
-        top_k=150,
-        threads=22,
-        batch_size=40,
-        gpu_layers=50,
-    )
-except ValueError as e:
-    raise FileNotFoundError(
-        "Model not found. Please ensure that the model is located in the correct folder."
-    )
+# the model file, also used to key the stored results
+model_file = "13B-chat-GGUF-q5_K_M.gguf"
+
+# number of model instances scoring pairs in parallel, each loads its own copy of the model,
+# so raise this only if there is memory for it; the CPU threads are split between them
+num_workers = 1
+total_threads = 22
+
+
+def load_model(threads):
+    """
+    Loads an instance of the Llama2 model.
+
+    Parameters:
+    - threads (int): The number of CPU threads the instance uses.
+
+    Returns:
+    - LLM: The loaded model.
+    """
+    # try loading model
+    try:
+        return AutoModelForCausalLM.from_pretrained(
+            model_path_or_repo_id=f"./models/{model_file}",
+            model_file=model_file,
+            model_type="llama",
+            max_new_tokens=75,
+            repetition_penalty=1.2,
+            temperature=0.25,
+            top_p=0.95,
+            top_k=150,
+            threads=threads,
+            batch_size=40,
+            gpu_layers=50,
+        )
+    except ValueError as e:
+        raise FileNotFoundError(
+            "Model not found. Please ensure that the model is located in the correct folder."
+        )
+
+
+llms = [load_model(max(1, total_threads // num_workers)) for _ in range(num_workers)]
+llm = llms[0]
 
 # ## Step 2: Load Excel Spreadsheet and make into a DataFrame.
 
@@ -43,15 +66,25 @@ except ValueError as e:
 
 
 import pandas as pd
+import numpy as np
 import os
 import re
+import time
+import queue
+import hashlib
+import sqlite3
+import functools
+import threading
 from itertools import product
 
-# specify the path to Excel file
+# specify the path to the hazard definitions, either an Excel or a Parquet file
 excel_file_path = "../data/hazard_definitions.xlsx"
 
-# read the Excel file into a pandas DataFrame
-df = pd.read_excel(excel_file_path)
+# read the hazard definitions into a pandas DataFrame
+if excel_file_path.endswith(".parquet"):
+    df = pd.read_parquet(excel_file_path)
+else:
+    df = pd.read_excel(excel_file_path)
 
 # ## Step 3: Define some helper functions to output correct scores.
 
@@ -91,87 +124,283 @@ def extract_score(response):
 unique_values = df["Hazard_Name"].unique()  # change to create AxA matrix, remove to make all
 print(unique_values)
 
-# create double-sided pairs without pairs with the same element
-pairs = [(x, y) for x, y in product(unique_values, unique_values) if x != y]
+# map each hazard name to its definition cut to the first sentence, and its code, once
+# (the first row of a name is used, as the per-pair lookup did)
+first_rows = df.drop_duplicates("Hazard_Name")
+hazard_lookup = {
+    name: (description.split(".")[0], code)
+    for name, description, code in zip(
+        first_rows["Hazard_Name"], first_rows["Hazard_Description"], first_rows["Hazard_Code"]
+    )
+}
+definitions = [hazard_lookup[name][0] for name in unique_values]
+hazard_index = {name: i for i, name in enumerate(unique_values)}
+
+# create double-sided pairs of indices into unique_values without pairs with the same element
+# pairs sharing hazard1 are consecutive, so they also share a prompt prefix (see run_llm)
+pairs = [(i, j) for i, j in product(range(len(unique_values)), repeat=2) if i != j]
 
 
-# ## Step 5: Create new dataframes to store new data.
+# ## Step 5: Set up the result store.
 
 # In[9]:
 
 
-# Check if the excel files already exist
-if os.path.exists("./out/scores.xlsx") and os.path.exists("./out/justifications.xlsx"):
-    # Load the existing excel files
-    scores_df = pd.read_excel("./out/scores.xlsx", index_col=0, dtype=str)
-    justification_df = pd.read_excel("./out/justifications.xlsx", index_col=0, dtype=str)
-else:
-    # Create new excel files
-    # print("poo")
-    scores_df = pd.DataFrame(index=unique_values, columns=unique_values)
-    justification_df = pd.DataFrame(index=unique_values, columns=unique_values)
+class ResultStore:
+    """
+    An append-only SQLite journal of LLM results. Every attempt at a hazard pair is a new row keyed
+    by the pair, the hash of the pair's prompt and the model, and is committed as soon as it is
+    recorded, so a crash loses at most the pair being scored and a rerun resumes from the missing
+    pairs.
 
-scores_df
+    Results imported from legacy matrix checkpoints are recorded under LEGACY_PROMPT_HASH, as their
+    prompt is unknown.
+    """
 
+    LEGACY_PROMPT_HASH = "legacy-import"
+
+    def __init__(self, path, model):
+        """
+        Opens or creates the store.
+
+        Parameters:
+        - path (str): The path of the SQLite database.
+        - model (str): The model the results come from.
+        """
+        self.model = model
+        self.connection = sqlite3.connect(path)
+        # the write-ahead log makes each commit an append rather than a rewrite of the database
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hazard1 TEXT NOT NULL,
+                hazard2 TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                score REAL NOT NULL,
+                response TEXT,
+                created REAL NOT NULL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_key ON results (model, prompt_hash, hazard1, hazard2)"
+        )
+        self.connection.commit()
+
+    def record(self, hazard1, hazard2, prompt_hash, score, response):
+        """
+        Appends and commits the result of one attempt at a hazard pair.
+
+        Parameters:
+        - hazard1 (str): The first hazard of the pair.
+        - hazard2 (str): The second hazard of the pair.
+        - prompt_hash (str): The hash of the prompt of the pair, see pair_prompt_hash.
+        - score (float): The extracted score, -1 if none was found.
+        - response (str): The response of the LLM.
+        """
+        self.record_many([(hazard1, hazard2, prompt_hash, score, response)])
+
+    def record_many(self, results):
+        """
+        Appends and commits many results in a single transaction.
+
+        Parameters:
+        - results (iterable): (hazard1, hazard2, prompt_hash, score, response) tuples.
+        """
+        created = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO results (hazard1, hazard2, prompt_hash, model, score, response, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (hazard1, hazard2, prompt_hash, self.model, score, response, created)
+                    for hazard1, hazard2, prompt_hash, score, response in results
+                ),
+            )
+
+    def is_empty(self):
+        """
+        Returns whether the store holds no results at all, for any model or prompt.
+        """
+        return self.connection.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+
+    def attempts(self):
+        """
+        Returns how many times every hazard pair has been scored with this model, per prompt.
+
+        Returns:
+        - dict: Maps (hazard1, hazard2, prompt_hash) to the number of attempts.
+        """
+        rows = self.connection.execute(
+            """SELECT hazard1, hazard2, prompt_hash, COUNT(*) FROM results
+            WHERE model = ? GROUP BY hazard1, hazard2, prompt_hash""",
+            (self.model,),
+        )
+        return {
+            (hazard1, hazard2, prompt_hash): count for hazard1, hazard2, prompt_hash, count in rows
+        }
+
+    def latest(self):
+        """
+        Returns the latest result of every hazard pair scored with this model, per prompt.
+
+        Returns:
+        - dict: Maps (hazard1, hazard2, prompt_hash) to (score, response).
+        """
+        rows = self.connection.execute(
+            """SELECT hazard1, hazard2, prompt_hash, score, response FROM results WHERE id IN (
+                SELECT MAX(id) FROM results WHERE model = ?
+                GROUP BY hazard1, hazard2, prompt_hash
+            )""",
+            (self.model,),
+        )
+        return {
+            (hazard1, hazard2, prompt_hash): (score, response)
+            for hazard1, hazard2, prompt_hash, score, response in rows
+        }
 
-# ### Step 5.5: Find the first pair which does not have a value stored
 
-# In[10]:
+# format of the exported matrices in ./out, "parquet" (Arrow) is much cheaper to write than "xlsx"
+output_format = "parquet"
+# also write Excel copies of the matrices, e.g. for reading in a spreadsheet
+export_excel = False
 
 
-def find_first_missing_pair(df):
+def save_matrix(matrix_df, name):
     """
-    Finds the first pair of row and column categories in a DataFrame where the corresponding element is missing.
+    Saves a score or justification matrix to ./out in the output format.
 
     Parameters:
-    - df (pd.DataFrame): The DataFrame to search for missing values.
+    - matrix_df (pd.DataFrame): The matrix, indexed and labelled by hazard name.
+    - name (str): The file name without extension, e.g. "scores".
+    """
+    if output_format == "parquet":
+        matrix_df.to_parquet(f"./out/{name}.parquet")
+    if output_format == "xlsx" or export_excel:
+        matrix_df.to_excel(f"./out/{name}.xlsx")
 
-    Returns:
-    - tuple or None: If a missing value is found, returns a tuple containing the row and column categories of the missing element. If no missing values are found, returns None.
+
+def import_matrices(store):
     """
-    categories = df.columns  # Exclude the first column which contains row headers
-    for i, row_category in enumerate(categories):
-        for j, col_category in enumerate(categories):
-            if i != j:  # Exclude pairs where both elements are the same
-                value = df.iloc[i, j]  # j+1 to account for the row header column
-                if pd.isna(value):  # Check if the value is NaN
-                    print(i, j)
-                    return (row_category, col_category)
-    return None
+    Imports the results of the Excel matrix checkpoints written by earlier versions of this script,
+    so an interrupted run can be resumed from them. Only a store with no results at all is
+    imported into, in a single transaction, and the results are recorded under
+    ResultStore.LEGACY_PROMPT_HASH, so the matrices this script exports are never read back as
+    results of the current prompts.
 
+    Parameters:
+    - store (ResultStore): The store to import into.
+    """
+    if not store.is_empty():
+        return
+    if not (os.path.exists("./out/scores.xlsx") and os.path.exists("./out/justifications.xlsx")):
+        return
+    scores_df = pd.read_excel("./out/scores.xlsx", index_col=0, dtype=str)
+    justification_df = pd.read_excel("./out/justifications.xlsx", index_col=0, dtype=str)
 
-missing_value = find_first_missing_pair(scores_df)
+    # Excel checkpoints are read back as strings
+    scores_df = scores_df.apply(pd.to_numeric, errors="coerce")
+    rows, columns = scores_df.notna().to_numpy().nonzero()
+    store.record_many(
+        (
+            scores_df.index[i],
+            scores_df.columns[j],
+            store.LEGACY_PROMPT_HASH,
+            scores_df.iat[i, j],
+            justification_df.loc[scores_df.index[i], scores_df.columns[j]],
+        )
+        for i, j in zip(rows, columns)
+    )
+    print(f"Imported {len(rows)} results from the legacy matrix checkpoints")
 
 
-# ## Step 6: Run the LLM.
+def select_current(entries):
+    """
+    Picks the entry of every pair made with the pair's current prompt, falling back to a legacy
+    import, so pairs whose prompt changed since, e.g. after a definition was edited, are missing.
+    Hazards that are no longer in the definitions are skipped.
 
-# In[11]:
+    Parameters:
+    - entries (dict): Maps (hazard1, hazard2, prompt_hash) to a value, as returned by the store.
 
+    Returns:
+    - dict: Maps (i, j) pairs of indices into unique_values to the value.
+    """
+    current = {}
+    for (hazard1, hazard2, entry_hash), value in entries.items():
+        if hazard1 not in hazard_index or hazard2 not in hazard_index:
+            continue
+        pair = (hazard_index[hazard1], hazard_index[hazard2])
+        if entry_hash == pair_prompt_hash(*pair):
+            current[pair] = value
+        elif entry_hash == ResultStore.LEGACY_PROMPT_HASH:
+            current.setdefault(pair, value)
+    return current
+
+
+def load_attempts(store):
+    """
+    Loads the number of attempts at every pair with its current prompt into an array indexed like
+    unique_values.
 
-def run_llm(hazard1, hazard2, def1, def2):
+    Parameters:
+    - store (ResultStore): The store to load.
+
+    Returns:
+    - np.ndarray: The integer number of attempts per pair.
     """
-    Run a likelihood assessment using a Language Model (LLM) to evaluate the likelihood that a given hazard1 causes hazard2.
+    attempts = np.zeros((len(unique_values), len(unique_values)), dtype=int)
+    for (i, j), count in select_current(store.attempts()).items():
+        attempts[i, j] = count
+    return attempts
+
+
+def load_results(store):
+    """
+    Loads the latest result of every pair with its current prompt into score and justification
+    arrays indexed like unique_values.
 
     Parameters:
-    - hazard1 (str): The first hazard in the assessment.
-    - hazard2 (str): The second hazard in the assessment.
-    - def1 (str): The definition of the first hazard.
-    - def2 (str): The definition of the second hazard.
+    - store (ResultStore): The store to load.
 
     Returns:
-    tuple: A tuple containing the numerical score representing the likelihood assessment (ranging from 0 to 5) and the detailed response from the language model.
+    - tuple: The float score array, NaN where a pair has no result, and the object array of
+      justifications.
     """
-    # cut definitions to be only first sentence
-    def1 = def1.split(".")[0]
-    def2 = def2.split(".")[0]
+    scores = np.full((len(unique_values), len(unique_values)), np.nan)
+    justifications = np.full(scores.shape, None, dtype=object)
+    for (i, j), (score, response) in select_current(store.latest()).items():
+        scores[i, j] = score
+        justifications[i, j] = response
+    return scores, justifications
 
-    # begin prompting
-    prompt = f"""What is the likelihood that {hazard1} causes {hazard2}, bearing in mind:
+
+def export_matrices():
+    """
+    Writes the score and justification arrays as matrices labelled by hazard name.
+    """
+    save_matrix(pd.DataFrame(scores, index=unique_values, columns=unique_values), "scores")
+    save_matrix(
+        pd.DataFrame(justifications, index=unique_values, columns=unique_values), "justifications"
+    )
+
+
+# ## Step 6: Run the LLM.
+
+# In[11]:
+
+
+# The prompt is ordered from the most to the least shared text: the system preamble (the same for
+# every pair), then hazard1 and its definition (the same for a run of consecutive pairs), then
+# hazard2. ctransformers keeps the evaluated tokens of the previous prompt of an instance and only
+# evaluates the tokens after the longest common prefix, so the preamble is evaluated once per model
+# instance and hazard1's definition once per hazard1.
+PROMPT_TEMPLATE = """Bearing in mind:
     {hazard1}: {def1}
     {hazard2}: {def2}
+    What is the likelihood that {hazard1} causes {hazard2}?
     """
 
-    super_prompt = f"""
+SUPER_PROMPT_TEMPLATE = """
     SYSTEM: We're evaluating the likelihood of various hazards causing specific outcomes. Your responses should be one number between 0 and 5, following the below scale. Include a short explanation for your score, as it helps understand the reasoning behind your assessment.
     
     - 0: Almost never
@@ -188,7 +417,80 @@ def run_llm(hazard1, hazard2, def1, def2):
     ASSISTANT:
     """
 
-    response = llm(super_prompt)
+# temperature of the first attempt at a pair, doubled on every retry up to max_temperature
+base_temperature = 0.25
+max_temperature = 1.5
+
+# instructions added to the prompt of retries, cycled through, to steer the model to a score
+RETRY_INSTRUCTIONS = [
+    "Begin your answer with the score as a single digit from 0 to 5.",
+    "Answer in the form 'Score: <0-5>. Reason: <one sentence>'.",
+    "Reply with a number from 0 to 5 first, then one short sentence.",
+]
+
+
+def render_prompt(hazard1, hazard2, def1, def2, attempt=0):
+    """
+    Renders the full prompt of a hazard pair.
+
+    Parameters:
+    - hazard1 (str): The first hazard in the assessment.
+    - hazard2 (str): The second hazard in the assessment.
+    - def1 (str): The first sentence of the definition of the first hazard.
+    - def2 (str): The first sentence of the definition of the second hazard.
+    - attempt (int): How many earlier attempts at this pair failed to give a score, retries add
+      an extra instruction.
+
+    Returns:
+    - str: The prompt passed to the model.
+    """
+    prompt = PROMPT_TEMPLATE.format(hazard1=hazard1, hazard2=hazard2, def1=def1, def2=def2)
+    if attempt:
+        # added at the end, so retries still share the prompt prefix
+        prompt += f"{RETRY_INSTRUCTIONS[(attempt - 1) % len(RETRY_INSTRUCTIONS)]}\n    "
+    return SUPER_PROMPT_TEMPLATE.format(prompt=prompt)
+
+
+@functools.lru_cache(maxsize=None)
+def pair_prompt_hash(i, j):
+    """
+    Hashes the first-attempt prompt of a pair, which covers the templates and both hazards' names
+    and definitions, so results are only reused while the prompt they were produced with is
+    unchanged. Retries of a pair are recorded under the same hash.
+
+    Parameters:
+    - i (int): The index of the first hazard in unique_values.
+    - j (int): The index of the second hazard in unique_values.
+
+    Returns:
+    - str: The first 16 hex digits of the SHA-256 of the prompt.
+    """
+    prompt = render_prompt(unique_values[i], unique_values[j], definitions[i], definitions[j])
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+def run_llm(hazard1, hazard2, def1, def2, model=None, attempt=0):
+    """
+    Run a likelihood assessment using a Language Model (LLM) to evaluate the likelihood that a given hazard1 causes hazard2.
+
+    Parameters:
+    - hazard1 (str): The first hazard in the assessment.
+    - hazard2 (str): The second hazard in the assessment.
+    - def1 (str): The first sentence of the definition of the first hazard.
+    - def2 (str): The first sentence of the definition of the second hazard.
+    - model (LLM): The model instance to run, defaults to the first loaded one.
+    - attempt (int): How many earlier attempts at this pair failed to give a score. Retries use
+      a higher temperature and an extra instruction.
+
+    Returns:
+    tuple: A tuple containing the numerical score representing the likelihood assessment (ranging from 0 to 5) and the detailed response from the language model.
+    """
+    # begin prompting
+    super_prompt = render_prompt(hazard1, hazard2, def1, def2, attempt)
+    temperature = min(base_temperature * 2**attempt, max_temperature)
+
+    # reset=True keeps the context shared with the previous prompt rather than clearing it
+    response = (model or llm)(super_prompt, reset=True, temperature=temperature)
     print(f"Running: {hazard1}, {hazard2}")
     print(response)
     score = extract_score(response)
@@ -196,85 +498,156 @@ def run_llm(hazard1, hazard2, def1, def2):
     return (score, response)
 
 
-# ## Step 7: Record and update spreadsheets.
+def run_pairs(pairs, record, models=llms, report_every=20, attempt=0):
+    """
+    Scores hazard pairs on one worker thread per model instance. The pairs are fed through a
+    bounded queue, so only a few are in flight at once. Each result is passed to record on the
+    calling thread as it completes, and the throughput is reported in pairs/sec.
+
+    Parameters:
+    - pairs (list): The (i, j) pairs of indices into unique_values to score.
+    - record (callable): Called with (pair, score, response) for every scored pair.
+    - models (list): The model instances, one worker thread each.
+    - report_every (int): How many pairs to score between throughput reports.
+    - attempt (int): How many earlier attempts at these pairs failed, passed to run_llm.
+
+    Returns:
+    - float: The overall throughput in pairs/sec.
+    """
+    tasks = queue.Queue(maxsize=2 * len(models))
+    results = queue.Queue()
+
+    def feed():
+        for pair in pairs:
+            tasks.put(pair)
+        for _ in models:
+            tasks.put(None)
+
+    def work(model):
+        while True:
+            pair = tasks.get()
+            if pair is None:
+                return
+            try:
+                i, j = pair
+                score, response = run_llm(
+                    unique_values[i],
+                    unique_values[j],
+                    definitions[i],
+                    definitions[j],
+                    model,
+                    attempt,
+                )
+            except Exception as e:
+                results.put((pair, e, None))
+                return
+            results.put((pair, score, response))
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=work, args=(model,), daemon=True) for model in models]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    for done in range(1, len(pairs) + 1):
+        pair, score, response = results.get()
+        if isinstance(score, Exception):
+            raise score
+        record(pair, score, response)
+        if done % report_every == 0 or done == len(pairs):
+            elapsed = time.perf_counter() - start
+            print(f"ITERATION {done} of {len(pairs)}, {done / elapsed:.3f} pairs/sec")
+
+    elapsed = time.perf_counter() - start
+    return len(pairs) / elapsed if elapsed else 0.0
+
+
+# ## Step 7: Run the missing pairs and record the results.
 
 # In[13]:
 
 
-# store the scores and justifications in the new dataframes
-i = 0
-# missing_value contains the first pair that does not have a value stored, slice the pairs list to start from there
-pairs = pairs[pairs.index(missing_value) :]
-length_pairs = len(pairs)
+# open the result store, importing any Excel checkpoints from earlier versions into an empty one
+store = ResultStore("./out/results.sqlite", model_file)
+import_matrices(store)
+scores, justifications = load_results(store)
+attempts = load_attempts(store)
 
-for pair in pairs:
-    print(f"ITERATION {i} of {length_pairs}")
-    data = run_llm(
-        pair[0],
-        pair[1],
-        df[df["Hazard_Name"] == pair[0]]["Hazard_Description"].values[0],
-        df[df["Hazard_Name"] == pair[1]]["Hazard_Description"].values[0],
-    )
-    scores_df.loc[pair[0], pair[1]] = data[0]
-    justification_df.loc[pair[0], pair[1]] = data[1]
-    if i % 20 == 0:
-        scores_df.to_excel("./out/scores.xlsx")
-        justification_df.to_excel("./out/justifications.xlsx")
-    i += 1
+
+def record_result(pair, score, response):
+    """
+    Commits the result of a pair to the store as soon as it lands and updates the arrays.
+    """
+    i, j = pair
+    store.record(unique_values[i], unique_values[j], pair_prompt_hash(i, j), score, response)
+    scores[i, j] = score
+    justifications[i, j] = response
+    attempts[i, j] += 1
 
 
-# ## Step 8: Rerun all instances of -1, until there are no more -1's
+# only run the pairs that do not have a result yet
+pairs = [(i, j) for i, j in pairs if np.isnan(scores[i, j])]
+run_pairs(pairs, record_result)
+
+export_matrices()
+
+
+# ## Step 8: Retry the instances of -1 within a bounded budget
 
 # In[14]:
 
+# number of retries of a pair that gives no score before it is recorded as failed
+max_retries = 5
+
 
-def find_invalid_pairs():
+def find_invalid_pairs(attempt=None):
     """
-    Finds pairs of row and column categories in the scores DataFrame where the corresponding element is -1
+    Finds the hazard pairs whose latest score is -1
+
+    Parameters:
+    - attempt (int): Only return the pairs that have been attempted this many times.
 
     Returns:
-    - list: A list of tuples containing the row and column categories of the missing elements.
+    - list: A list of (i, j) pairs of indices into unique_values.
     """
-    scores_df = pd.read_excel("./out/scores.xlsx", index_col=0, dtype=str)
-    justification_df = pd.read_excel("./out/justifications.xlsx", index_col=0, dtype=str)
+    invalid = scores == -1
+    if attempt is not None:
+        invalid &= attempts == attempt
+    # in row order, so consecutive retries share hazard1 and their prompt prefix
+    return [tuple(pair) for pair in np.argwhere(invalid)]
 
-    # check which pairs are equal to -1
-    invalid_pairs = []
-    for i, row in scores_df.iterrows():
-        for j, value in row.items():
-            if value == "-1":
-                invalid_pairs.append((i, j))
 
-    return invalid_pairs
+def save_failed_pairs(failed_pairs):
+    """
+    Writes the pairs that still have no score after every retry to ./out/failed_pairs.csv, for
+    manual review.
+
+    Parameters:
+    - failed_pairs (list): The (i, j) pairs of indices into unique_values.
+    """
+    pd.DataFrame(
+        {
+            "Hazard_1": [unique_values[i] for i, _ in failed_pairs],
+            "Hazard_2": [unique_values[j] for _, j in failed_pairs],
+            "Attempts": [attempts[i, j] for i, j in failed_pairs],
+            "Last_Response": [justifications[i, j] for i, j in failed_pairs],
+        }
+    ).to_csv("./out/failed_pairs.csv", index=False)
 
 
 # In[15]:
 
 
-# add the invalid pairs to update score_df
-j = 0
-invalid_pairs = find_invalid_pairs()
-print(invalid_pairs)
-length_invalid_pairs = len(invalid_pairs)
-
-# until no more invalid pairs
-while invalid_pairs:
-    print("STARTING NEW INVALID CORRECTION ITERATION...........")
-    for pair in invalid_pairs:
-        print(f"ITERATION {j} of {length_invalid_pairs}")
-        data = run_llm(
-            pair[0],
-            pair[1],
-            df[df["Hazard_Name"] == pair[0]]["Hazard_Description"].values[0],
-            df[df["Hazard_Name"] == pair[1]]["Hazard_Description"].values[0],
-        )
-        scores_df.loc[pair[0], pair[1]] = data[0]
-        justification_df.loc[pair[0], pair[1]] = data[1]
-        if j % 20 == 0:
-            scores_df.to_excel("./out/scores.xlsx")
-            justification_df.to_excel("./out/justifications.xlsx")
-        j += 1
-    # reset, and check again
-    j = 0
-    invalid_pairs = find_invalid_pairs()
-    length_invalid_pairs = len(invalid_pairs)
+# retry the invalid pairs in rounds, pairs that already used retries in an earlier run of the
+# script join the round matching their number of attempts
+for attempt in range(1, max_retries + 1):
+    invalid_pairs = find_invalid_pairs(attempt)
+    if invalid_pairs:
+        print(f"STARTING INVALID CORRECTION ROUND {attempt} OF {max_retries}...........")
+        run_pairs(invalid_pairs, record_result, attempt=attempt)
+
+failed_pairs = find_invalid_pairs()
+save_failed_pairs(failed_pairs)
+print(f"{len(failed_pairs)} pairs gave no score after {max_retries} retries")
+
+export_matrices()
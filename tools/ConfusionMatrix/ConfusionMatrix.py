@@ -1,11 +1,579 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
 import pandas as pd
 import numpy as np
-from typing import List
+from typing import Callable, List, Tuple
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
-import seaborn as sns
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
+
+logger = logging.getLogger(__name__)
+
+TABLE_FORMATS = ["parquet", "feather", "csv", "xlsx"]
+
+
+def read_table(file_path: str) -> pd.DataFrame:
+    """
+    Reads a table in any of the supported formats, chosen by the file extension.
+
+    Args:
+        file_path (str): The path of a .parquet, .feather, .csv, .json or .xlsx file.
+
+    Returns:
+        pd.DataFrame: The table.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(file_path)
+    if extension in (".feather", ".arrow"):
+        return pd.read_feather(file_path)
+    if extension == ".csv":
+        return pd.read_csv(file_path)
+    if extension == ".json":
+        return pd.read_json(file_path, orient="records")
+    return pd.read_excel(file_path)
+
+
+def write_table(table: pd.DataFrame, file_path: str) -> None:
+    """
+    Writes a table without its index in the format given by the file extension.
+
+    Args:
+        table (pd.DataFrame): The table to be written.
+        file_path (str): The path of a .parquet, .feather, .csv or .xlsx file.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".parquet":
+        table.to_parquet(file_path, index=False)
+    elif extension in (".feather", ".arrow"):
+        table.reset_index(drop=True).to_feather(file_path)
+    elif extension == ".csv":
+        table.to_csv(file_path, index=False)
+    else:
+        table.to_excel(file_path, index=False)
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the process in megabytes, or None where the resource
+    module is unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        max_rss //= 1024
+    return max_rss / 1024
+
+
+def log_event(event: str, **fields) -> None:
+    """
+    Logs an event as a single JSON object, so timings can be collected from the logs of batch runs.
+
+    Args:
+        event (str): The name of the event.
+        **fields: The values recorded with the event.
+    """
+    logger.info(json.dumps({"event": event, **fields}))
+
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Selects the top_k highest scores in each row using argpartition, so only the selected scores
+    are sorted.
+
+    Args:
+        scores (np.ndarray): The score matrix, with -inf for entries that must not be selected.
+        top_k (int): The number of columns to select per row.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The selected column indices per row, highest score first and
+        -1 where fewer than top_k scores are finite, and their scores.
+    """
+    top_k = min(top_k, scores.shape[1])
+    candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    top_indices = np.take_along_axis(candidates, order, axis=1)
+    top_scores = np.take_along_axis(candidate_scores, order, axis=1)
+    top_indices[~np.isfinite(top_scores)] = -1
+    return top_indices, top_scores
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Scales each embedding to unit length, so dot products are cosine similarities.
+
+    Args:
+        embeddings (np.ndarray): The embeddings, one per row.
+
+    Returns:
+        np.ndarray: The normalised float32 embeddings.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def chunked_top_k(
+    queries: np.ndarray,
+    keys: np.ndarray,
+    top_k: int,
+    chunk_size: int = 1024,
+    min_score: float = -np.inf,
+    max_score: float = np.inf,
+    exclude_self: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the top_k most cosine-similar keys for each query without materialising the full
+    similarity matrix. Similarities are computed in float32 blocks of at most chunk_size queries by
+    chunk_size keys, and the running top_k of each query is merged with the top_k of every block.
+
+    Args:
+        queries (np.ndarray): The query embeddings, one per row.
+        keys (np.ndarray): The key embeddings, one per row, or a QuantizedEmbeddingStore.
+        top_k (int): The number of keys to select per query.
+        chunk_size (int): The number of queries and keys per block, which bounds peak memory.
+        min_score (float): Scores at or below this value are ignored.
+        max_score (float): Scores at or above this value are ignored.
+        exclude_self (bool): Whether to skip the key at the same position as the query, for when
+            the queries are the keys.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The key positions per query, most similar first and -1 where
+        fewer than top_k keys pass the thresholds, and their scores.
+    """
+    queries = normalize_rows(queries)
+    top_k = min(top_k, len(keys))
+    top_indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+    top_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+
+    for row_start in range(0, len(queries), chunk_size):
+        rows = slice(row_start, row_start + chunk_size)
+        best_indices, best_scores = top_indices[rows], top_scores[rows]
+        for column_start in range(0, len(keys), chunk_size):
+            # keys are normalised a block at a time so they can be a memory-mapped or quantised store
+            block = queries[rows] @ normalize_rows(keys[column_start : column_start + chunk_size]).T
+            block[(block <= min_score) | (block >= max_score)] = -np.inf
+            if exclude_self:
+                row_positions = np.arange(row_start, row_start + len(block))
+                own_columns = row_positions - column_start
+                inside = (own_columns >= 0) & (own_columns < block.shape[1])
+                block[np.flatnonzero(inside), own_columns[inside]] = -np.inf
+
+            block_indices, block_scores = top_k_rows(block, top_k)
+            block_indices = np.where(block_indices >= 0, block_indices + column_start, -1)
+            merged_indices, merged_scores = top_k_rows(
+                np.hstack([best_scores, block_scores]), top_k
+            )
+            candidates = np.hstack([best_indices, block_indices])
+            best_indices = np.where(
+                merged_indices >= 0,
+                np.take_along_axis(candidates, np.maximum(merged_indices, 0), axis=1),
+                -1,
+            )
+            best_scores = merged_scores
+        top_indices[rows], top_scores[rows] = best_indices, best_scores
+
+    return top_indices, top_scores
+
+
+def write_similarity_matrix(
+    embeddings: np.ndarray, output_path: str, chunk_size: int = 1024
+) -> np.ndarray:
+    """
+    Writes the cosine similarity matrix of the embeddings to a float32 .npy file one block of rows
+    at a time, so only chunk_size rows are held in memory.
+
+    Args:
+        embeddings (np.ndarray): The embeddings, one per row.
+        output_path (str): The path of the .npy file.
+        chunk_size (int): The number of rows computed per block.
+
+    Returns:
+        np.ndarray: The similarity matrix, memory-mapped from the written file.
+    """
+    embeddings = normalize_rows(embeddings)
+    similarity_matrix = np.lib.format.open_memmap(
+        output_path, mode="w+", dtype=np.float32, shape=(len(embeddings), len(embeddings))
+    )
+    for start in range(0, len(embeddings), chunk_size):
+        similarity_matrix[start : start + chunk_size] = (
+            embeddings[start : start + chunk_size] @ embeddings.T
+        )
+    similarity_matrix.flush()
+    return similarity_matrix
+
+
+class QuantizedEmbeddingStore:
+    """
+    A memory-mapped store of unit-length embeddings quantised to float16, or to int8 with one
+    scale per vector, for keeping many report embeddings on disk at a half or a quarter of the
+    float32 size.
+
+    Slicing the store returns the dequantised float32 rows, so it can be passed as the keys of
+    chunked_top_k and searched one block at a time without loading it into memory.
+
+    Attributes:
+        path (str): The path of the .npy file holding the quantised embeddings.
+        dtype (str): The storage type, "float16" or "int8".
+        codes (np.ndarray): The memory-mapped quantised embeddings.
+        scales (np.ndarray): The memory-mapped per-vector scales of int8 embeddings, else None.
+
+    Methods:
+        create: Quantises embeddings and writes them to a new store.
+        search: Finds the most similar stored embeddings for each query.
+        recall: Measures how many of the full precision top_k results the store search finds.
+    """
+
+    DTYPES = ["float16", "int8"]
+
+    def __init__(self, path: str) -> None:
+        """
+        Opens an existing store read-only.
+
+        Args:
+            path (str): The path of the .npy file written by create.
+        """
+        self.path = path
+        self.codes = np.load(path, mmap_mode="r")
+        self.dtype = str(self.codes.dtype)
+        # only int8 stores have scales, a float16 store may sit next to those of an older store
+        self.scales = None
+        if self.codes.dtype == np.int8:
+            self.scales = np.load(self.scales_path(path), mmap_mode="r")
+
+    @staticmethod
+    def scales_path(path: str) -> str:
+        """
+        Returns the path of the per-vector scales stored next to int8 embeddings.
+        """
+        return f"{os.path.splitext(path)[0]}.scales.npy"
+
+    @classmethod
+    def create(
+        cls, path: str, embeddings: np.ndarray, dtype: str = "int8", chunk_size: int = 65536
+    ) -> "QuantizedEmbeddingStore":
+        """
+        Normalises and quantises embeddings one block at a time and writes them to a new store.
+
+        Args:
+            path (str): The path of the .npy file to write.
+            embeddings (np.ndarray): The embeddings, one per row, which may be memory-mapped.
+            dtype (str): The storage type, "float16" or "int8".
+            chunk_size (int): The number of embeddings quantised per block.
+
+        Returns:
+            QuantizedEmbeddingStore: The new store.
+        """
+        if dtype not in cls.DTYPES:
+            raise ValueError(f"Unknown dtype {dtype}, expected one of {cls.DTYPES}")
+        codes = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=embeddings.shape)
+        scales = None
+        if dtype == "int8":
+            scales = np.lib.format.open_memmap(
+                cls.scales_path(path), mode="w+", dtype=np.float32, shape=(len(embeddings), 1)
+            )
+        elif os.path.exists(cls.scales_path(path)):
+            os.remove(cls.scales_path(path))
+
+        for start in range(0, len(embeddings), chunk_size):
+            block = normalize_rows(embeddings[start : start + chunk_size])
+            if dtype == "int8":
+                block_scales = np.abs(block).max(axis=1, keepdims=True) / 127
+                block_scales[block_scales == 0] = 1
+                codes[start : start + chunk_size] = np.round(block / block_scales)
+                scales[start : start + chunk_size] = block_scales
+            else:
+                codes[start : start + chunk_size] = block
+
+        codes.flush()
+        if scales is not None:
+            scales.flush()
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows: slice) -> np.ndarray:
+        """
+        Returns the dequantised float32 embeddings of a slice of rows.
+        """
+        block = np.asarray(self.codes[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows]
+        return block
+
+    def search(
+        self, query_embeddings: np.ndarray, top_k: int = 10, chunk_size: int = 65536
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the most similar stored embeddings for each query, scanning the store in blocks.
+
+        Args:
+            query_embeddings (np.ndarray): The query embeddings, one per row.
+            top_k (int): The number of embeddings to return per query.
+            chunk_size (int): The number of stored embeddings compared per block.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The positions of the most similar stored embeddings per
+            query, most similar first, and their approximate cosine similarities.
+        """
+        return chunked_top_k(np.atleast_2d(query_embeddings), self, top_k, chunk_size)
+
+    def recall(
+        self, query_embeddings: np.ndarray, embeddings: np.ndarray, top_k: int = 10
+    ) -> float:
+        """
+        Measures the recall of the quantised search, the fraction of the full precision top_k
+        results of each query that the store search also returns.
+
+        Args:
+            query_embeddings (np.ndarray): The query embeddings, one per row.
+            embeddings (np.ndarray): The full precision embeddings the store was created from.
+            top_k (int): The number of results compared per query.
+
+        Returns:
+            float: The recall, between 0 and 1.
+        """
+        expected, _ = chunked_top_k(query_embeddings, embeddings, top_k)
+        found, _ = self.search(query_embeddings, top_k)
+        hits = sum(
+            len(set(expected_row[expected_row >= 0]) & set(found_row))
+            for expected_row, found_row in zip(expected, found)
+        )
+        return hits / max(int((expected >= 0).sum()), 1)
+
+
+class HazardEmbeddingIndex:
+    """
+    A nearest-neighbour index over hazard description embeddings, used to find candidate hazards
+    for the sentences of a report without calling a remote model.
+
+    The exact backend is a brute-force matrix product in NumPy. The optional "hnsw" (hnswlib) and
+    "faiss" (faiss-cpu) backends build an approximate graph index instead.
+
+    Attributes:
+        hazard_codes (List[str]): The hazard codes, one per indexed embedding.
+        embeddings (np.ndarray): The normalised hazard embeddings.
+        backend (str): The search backend, "exact", "hnsw" or "faiss".
+
+    Methods:
+        search: Finds the most similar hazards for each query embedding.
+        classify: Finds the candidate hazards for a report from its sentences.
+    """
+
+    BACKENDS = ["exact", "hnsw", "faiss"]
+
+    def __init__(
+        self, hazard_codes: List[str], embeddings: np.ndarray, backend: str = "exact"
+    ) -> None:
+        """
+        Initializes the HazardEmbeddingIndex class and builds the approximate index if requested.
+
+        Args:
+            hazard_codes (List[str]): The hazard codes, one per embedding.
+            embeddings (np.ndarray): The hazard description embeddings.
+            backend (str): The search backend, "exact", "hnsw" or "faiss".
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {self.BACKENDS}")
+        self.hazard_codes = list(hazard_codes)
+        self.embeddings = normalize_rows(embeddings)
+        self.backend = backend
+        self._ann_index = None
+
+        size, dimension = self.embeddings.shape
+        try:
+            if backend == "hnsw":
+                import hnswlib
+
+                self._ann_index = hnswlib.Index(space="ip", dim=dimension)
+                self._ann_index.init_index(max_elements=size, ef_construction=200, M=16)
+                self._ann_index.add_items(self.embeddings, np.arange(size))
+            elif backend == "faiss":
+                import faiss
+
+                self._ann_index = faiss.IndexHNSWFlat(dimension, 32, faiss.METRIC_INNER_PRODUCT)
+                self._ann_index.add(self.embeddings)
+        except ImportError as e:
+            raise ImportError(
+                f"The {backend} backend needs the {'hnswlib' if backend == 'hnsw' else 'faiss-cpu'}"
+                " package. Install it or use the exact backend."
+            ) from e
+
+    def search(self, query_embeddings: np.ndarray, top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the most similar hazards for each query embedding.
+
+        Args:
+            query_embeddings (np.ndarray): The query embeddings, one per row.
+            top_k (int): The number of hazards to return per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The hazard positions per query, most similar first and -1
+            where fewer than top_k hazards were found, and their cosine similarities.
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        top_k = min(top_k, len(self.hazard_codes))
+        if self.backend == "hnsw":
+            self._ann_index.set_ef(max(50, top_k))
+            indices, distances = self._ann_index.knn_query(queries, k=top_k)
+            return indices.astype(np.int64), 1 - distances
+        if self.backend == "faiss":
+            scores, indices = self._ann_index.search(queries, top_k)
+            return indices, scores
+        return chunked_top_k(queries, self.embeddings, top_k)
+
+    def classify(
+        self,
+        sentences: List[str],
+        encode: Callable[[List[str]], np.ndarray],
+        top_k: int = 5,
+    ) -> List[Tuple[str, float]]:
+        """
+        Finds the candidate hazards for a report, scoring each hazard by its best matching sentence.
+
+        Args:
+            sentences (List[str]): The sentences of the report.
+            encode (Callable[[List[str]], np.ndarray]): Encodes a list of texts into embeddings,
+                with the same model used for the hazard embeddings.
+            top_k (int): The number of candidate hazards to return.
+
+        Returns:
+            List[Tuple[str, float]]: The candidate hazard codes and their scores, best first.
+        """
+        sentences = [sentence for sentence in sentences if sentence.strip()]
+        if not sentences:
+            return []
+        indices, scores = self.search(encode(sentences), top_k)
+
+        best_scores = {}
+        for position, score in zip(indices.ravel(), scores.ravel()):
+            if position >= 0 and score > best_scores.get(position, -np.inf):
+                best_scores[position] = float(score)
+        ranked = sorted(best_scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.hazard_codes[position], score) for position, score in ranked]
+
+
+class EmbeddingCache:
+    """
+    An on-disk store of sentence embeddings for one model, keyed by the hash of each text.
+
+    Embeddings are kept in a .npy file, memory-mapped when read, alongside a JSON manifest that
+    records the model name and the text hash of every row.
+
+    Attributes:
+        model_name (str): The name or path of the sentence transformer model.
+        embeddings_path (str): The path of the .npy file holding the embeddings.
+        manifest_path (str): The path of the JSON manifest.
+
+    Methods:
+        hash_text: Returns the hash that identifies a text in the cache.
+        load: Loads the cached text hashes and embeddings.
+        get_embeddings: Returns the embeddings of the texts, encoding only those not in the cache.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str) -> None:
+        """
+        Initializes the EmbeddingCache class.
+
+        Args:
+            cache_dir (str): The folder where the cache files are stored.
+            model_name (str): The name or path of the sentence transformer model.
+        """
+        self.model_name = model_name
+        model_key = hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:12]
+        file_stem = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)}-{model_key}"
+        self.embeddings_path = os.path.join(cache_dir, f"{file_stem}.npy")
+        self.manifest_path = os.path.join(cache_dir, f"{file_stem}.json")
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """
+        Returns the hash that identifies a text in the cache.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            str: The SHA-256 hex digest of the text.
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Loads the cached text hashes and embeddings. Rows are only ever appended, so embedding rows
+        past the end of the manifest, left by a write interrupted between the two files, are
+        ignored, and a manifest longer than the embeddings is treated as nothing cached.
+
+        Returns:
+            Tuple[List[str], np.ndarray]: The text hashes and the memory-mapped embeddings, or an
+            empty list and None if nothing is cached for the model.
+        """
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.embeddings_path)):
+            return [], None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["model"] != self.model_name:
+            return [], None
+        hashes = manifest["hashes"]
+        embeddings = np.load(self.embeddings_path, mmap_mode="r")
+        if len(hashes) > len(embeddings):
+            return [], None
+        return hashes, embeddings[: len(hashes)]
+
+    def get_embeddings(
+        self, texts: List[str], encode: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Returns the embeddings of the texts, encoding only those not in the cache and adding them
+        to it.
+
+        Args:
+            texts (List[str]): The texts to embed.
+            encode (Callable[[List[str]], np.ndarray]): Encodes a list of texts into embeddings.
+
+        Returns:
+            np.ndarray: The embeddings, one row per text.
+        """
+        hashes, embeddings = self.load()
+        positions = {text_hash: i for i, text_hash in enumerate(hashes)}
+        text_hashes = [self.hash_text(text) for text in texts]
+
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in positions and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            new_embeddings = np.asarray(encode(list(missing.values())))
+            embeddings = (
+                new_embeddings
+                if embeddings is None
+                else np.concatenate([embeddings, new_embeddings.astype(embeddings.dtype)])
+            )
+            for text_hash in missing:
+                positions[text_hash] = len(hashes)
+                hashes.append(text_hash)
+
+            os.makedirs(os.path.dirname(self.embeddings_path) or ".", exist_ok=True)
+            # write to temporary files first so an interrupted run never leaves a torn file, and
+            # replace the embeddings before the manifest so at worst they have extra rows
+            np.save(f"{self.embeddings_path}.tmp.npy", embeddings)
+            with open(f"{self.manifest_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "hashes": hashes}, f)
+            os.replace(f"{self.embeddings_path}.tmp.npy", self.embeddings_path)
+            os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+        return np.asarray(embeddings[[positions[text_hash] for text_hash in text_hashes]])
 
 
 class ConfusionMatrixGenerator:
@@ -15,41 +583,221 @@ class ConfusionMatrixGenerator:
     Attributes:
         hazard_df (pandas.DataFrame): The DataFrame containing hazard information.
         output_folder (str): The folder path where the output files will be saved.
-        model (str): The name or path of the sentence transformer model.
+        output_format (str): The format of the tabular outputs, such as "parquet".
+        export_excel (bool): Whether Excel copies of the outputs are also written.
+        top_k (int): The number of most similar hazards kept for each hazard.
+        threshold (float): Similarities at or below this value are never confused hazards.
+        batch_size (int): The number of descriptions encoded per batch.
+        device (str): The device the model runs on.
+        threads (int): The number of CPU threads used by torch while encoding.
+        normalize (bool): Whether the model returns unit-length embeddings.
+        model_name (str): The name or path of the sentence transformer model.
+        model (SentenceTransformer): The sentence transformer model, loaded on first use.
+        embedding_cache (EmbeddingCache): The on-disk cache of hazard description embeddings.
         unique_categories (List[str]): A list of unique hazard categories.
         cumulative_counts (List[int]): A list of cumulative counts for each hazard category.
         confusion_df (pandas.DataFrame): The DataFrame containing the confused hazards.
 
     Methods:
+        build_embedding_index: Builds a nearest-neighbour index over the hazard description embeddings.
+        quantize_embeddings: Writes the description embeddings to a float16 or int8 store.
+        encode_texts: Encodes texts with the model and logs the encoding throughput.
+        encode_descriptions: Returns the hazard description embeddings, encoding only uncached ones.
         find_category_lines: Finds the positions of category boundaries in the similarity matrix.
         visualize_heatmap: Visualizes the similarity matrix as a heatmap with ordered category lines.
-        save_similarity_matrix: Saves the similarity matrix as an Excel file.
+        save_similarity_matrix: Saves the similarity matrix as a .npy file, and optionally as an Excel file.
         generate_similarity_pairs: Generate pairs of hazard codes along with their similarity scores based on a similarity matrix.
         filter_similarity_pairs: Filters the similarity pairs based on the similarity score.
+        select_top_confused: Selects the most similar other hazards for each row of the similarity matrix.
         generate_confused_hazards: Creates a dataframe with the most similar hazards for each hazard.
-        save_confused_pairs: Saves the confused pairs as Excel and JSON files.
+        save_table: Saves a table to the output folder in the output format.
+        save_confused_pairs: Saves the confused pairs as a table and a JSON file.
         add_confused_to_definitions: Adds the confused hazards to the hazard definitions.
         show_plotly_heatmap: Visualizes the similarity matrix as an interactive heatmap using Plotly.
+        compute_similarity_matrix: Computes the similarity matrix of the hazard descriptions.
         run_plotly_heatmap: Runs the ConfusionMatrixGenerator to generate and display an interactive heatmap using Plotly.
         run: Runs the ConfusionMatrixGenerator to generate and save the confusion matrix and other outputs.
+        run_chunked: Runs the ConfusionMatrixGenerator in blocks with bounded memory.
+        save_updated_definitions: Saves the hazard definitions with their Confused_Hazards replaced.
+        save_similarity_state: Saves the similarity matrix with the hazards it was computed from.
+        load_similarity_state: Loads the similarity state saved by the previous run.
+        description_hashes: Returns the hash of every hazard description.
+        update_similarity_matrix: Recomputes only the similarities of new or edited hazards.
+        run_incremental: Updates the confused hazards of only the hazards affected by edits.
     """
 
-    def __init__(self, model: str, data_file_path: str, output_folder: str) -> None:
+    def __init__(
+        self,
+        model: str,
+        data_file_path: str,
+        output_folder: str,
+        cache_dir: str = None,
+        output_format: str = "parquet",
+        export_excel: bool = False,
+        top_k: int = 3,
+        threshold: float = 0.5,
+        batch_size: int = 32,
+        device: str = None,
+        threads: int = None,
+        normalize: bool = False,
+        hazard_df: pd.DataFrame = None,
+    ) -> None:
         """
         Initializes the ConfusionMatrixGenerator class.
 
         Args:
             model (str): The name or path of the sentence transformer model.
-            data_file_path (str): The file path of the data file containing hazard information.
+            data_file_path (str): The file path of the data file containing hazard information, in
+                any format read_table supports.
             output_folder (str): The folder path where the output files will be saved.
+            cache_dir (str): The folder for cached embeddings, defaults to an "embeddings" folder
+                in the output folder.
+            output_format (str): The format of the tabular outputs, one of TABLE_FORMATS.
+            export_excel (bool): Whether to also write Excel copies of the outputs, which is slow
+                for large tables.
+            top_k (int): The number of most similar hazards to keep for each hazard.
+            threshold (float): Similarities at or below this value are never confused hazards.
+            batch_size (int): The number of descriptions encoded per batch.
+            device (str): The device the model runs on, such as "cpu" or "cuda", chosen by
+                sentence-transformers if None.
+            threads (int): The number of CPU threads used by torch while encoding, or None to keep
+                the torch default.
+            normalize (bool): Whether the model returns unit-length embeddings. Similarities are
+                cosine either way, so cached embeddings are reused across this setting.
+            hazard_df (pandas.DataFrame): The hazard information if already loaded, otherwise it is
+                read from data_file_path.
         """
-        self.hazard_df = pd.read_excel(data_file_path)
+        if output_format not in TABLE_FORMATS:
+            raise ValueError(
+                f"Unknown output format {output_format}, expected one of {TABLE_FORMATS}"
+            )
+        self.hazard_df = read_table(data_file_path) if hazard_df is None else hazard_df
         self.output_folder = output_folder
-        self.model = SentenceTransformer(model)
+        self.output_format = output_format
+        self.export_excel = export_excel
+        self.top_k = top_k
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.device = device
+        self.threads = threads
+        self.normalize = normalize
+        self.model_name = model
+        self._model = None
+        self.embedding_cache = EmbeddingCache(
+            cache_dir or os.path.join(output_folder, "embeddings"), model
+        )
         self.unique_categories = None
         self.cumulative_counts = None
         self.confusion_df = None
 
+    @property
+    def model(self):
+        """
+        The sentence transformer model, only loaded when an embedding is missing from the cache.
+        """
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def build_embedding_index(self, backend: str = "exact") -> HazardEmbeddingIndex:
+        """
+        Builds a nearest-neighbour index over the hazard description embeddings.
+
+        Args:
+            backend (str): The search backend, "exact", "hnsw" or "faiss".
+
+        Returns:
+            HazardEmbeddingIndex: The index, whose classify method takes report sentences.
+        """
+        return HazardEmbeddingIndex(
+            self.hazard_df["Hazard_Code"].tolist(), self.encode_descriptions(), backend
+        )
+
+    def quantize_embeddings(self, dtype: str = "int8", top_k: int = 10) -> QuantizedEmbeddingStore:
+        """
+        Writes the hazard description embeddings to a quantised store in the output folder and
+        logs the recall of searching it against full precision, using every hazard as a query.
+
+        Args:
+            dtype (str): The storage type, "float16" or "int8".
+            top_k (int): The number of results compared per hazard in the recall check.
+
+        Returns:
+            QuantizedEmbeddingStore: The quantised store.
+        """
+        embeddings = self.encode_descriptions()
+        store = QuantizedEmbeddingStore.create(
+            f"{self.output_folder}/embeddings_{dtype}.npy", embeddings, dtype
+        )
+        log_event(
+            "quantize_embeddings",
+            model=self.model_name,
+            dtype=dtype,
+            bytes=store.codes.nbytes + (store.scales.nbytes if store.scales is not None else 0),
+            float32_bytes=embeddings.shape[0] * embeddings.shape[1] * 4,
+            recall_at_k=round(store.recall(embeddings, embeddings, top_k), 4),
+            top_k=top_k,
+        )
+        return store
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes texts with the model using the configured batch size, thread count and
+        normalisation, and logs the encoding time, throughput and peak RSS.
+
+        Args:
+            texts (List[str]): The texts to encode.
+
+        Returns:
+            np.ndarray: The embeddings, one row per text.
+        """
+        model = self.model
+        if self.threads:
+            import torch
+
+            torch.set_num_threads(self.threads)
+
+        start = time.perf_counter()
+        embeddings = model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=self.normalize
+        )
+        seconds = time.perf_counter() - start
+
+        log_event(
+            "encode",
+            model=self.model_name,
+            sentences=len(texts),
+            seconds=round(seconds, 3),
+            sentences_per_second=round(len(texts) / seconds, 1) if seconds else None,
+            batch_size=self.batch_size,
+            threads=self.threads,
+            device=self.device,
+            peak_rss_mb=peak_rss_mb(),
+        )
+        return embeddings
+
+    def encode_descriptions(self) -> np.ndarray:
+        """
+        Returns the hazard description embeddings, encoding only those not already cached.
+
+        Returns:
+            np.ndarray: The embeddings, one row per hazard.
+        """
+        start = time.perf_counter()
+        embeddings = self.embedding_cache.get_embeddings(
+            self.hazard_df["Hazard_Description"].tolist(), self.encode_texts
+        )
+        log_event(
+            "encode_descriptions",
+            model=self.model_name,
+            descriptions=len(embeddings),
+            seconds=round(time.perf_counter() - start, 3),
+            peak_rss_mb=peak_rss_mb(),
+        )
+        return embeddings
+
     def find_category_lines(self, categories: pd.Series) -> List[int]:
         """
         Finds the positions of category boundaries in the similarity matrix.
@@ -80,6 +828,9 @@ class ConfusionMatrixGenerator:
             similarity_matrix (np.ndarray): The similarity matrix to be visualized.
             line_positions_ordered (List[int]): The ordered line positions representing the category boundaries.
         """
+        import seaborn as sns
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(12, 10))
         sns.heatmap(similarity_matrix, cmap="viridis", xticklabels=False, yticklabels=False)
 
@@ -93,11 +844,20 @@ class ConfusionMatrixGenerator:
 
     def save_similarity_matrix(self, similarity_matrix: np.ndarray) -> None:
         """
-        Saves the similarity matrix as an Excel file.
+        Saves the similarity matrix as a float32 .npy file, whose rows and columns follow the order
+        of the hazard definitions, and as an Excel file labelled with the descriptions if
+        export_excel is set.
 
         Args:
             similarity_matrix (np.ndarray): The similarity matrix to be saved.
         """
+        np.save(
+            f"{self.output_folder}/confusion_matrix.npy",
+            np.asarray(similarity_matrix, dtype=np.float32),
+        )
+        if not self.export_excel:
+            return
+
         similarity_df = pd.DataFrame(
             similarity_matrix,
             columns=self.hazard_df["Hazard_Description"],
@@ -116,17 +876,15 @@ class ConfusionMatrixGenerator:
             pandas.DataFrame: A DataFrame containing the pairs of hazard codes and their similarity scores.
 
         """
-        pairs = []
-        for i in range(similarity_matrix.shape[0]):
-            for j in range(similarity_matrix.shape[1]):
-                pairs.append(
-                    {
-                        "Hazard_Code_1": self.hazard_df["Hazard_Code"].iloc[i],
-                        "Hazard_Code_2": self.hazard_df["Hazard_Code"].iloc[j],
-                        "Similarity_Score": similarity_matrix[i, j],
-                    }
-                )
-        return pd.DataFrame(pairs)
+        hazard_codes = self.hazard_df["Hazard_Code"].to_numpy()
+        rows, columns = similarity_matrix.shape
+        return pd.DataFrame(
+            {
+                "Hazard_Code_1": np.repeat(hazard_codes[:rows], columns),
+                "Hazard_Code_2": np.tile(hazard_codes[:columns], rows),
+                "Similarity_Score": similarity_matrix.ravel(),
+            }
+        )
 
     def filter_similarity_pairs(self, similarity_pairs_df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -144,29 +902,55 @@ class ConfusionMatrixGenerator:
         ]
         return similarity_pairs_df
 
+    def select_top_confused(
+        self,
+        similarity_matrix: np.ndarray,
+        top_k: int = None,
+        min_score: float = None,
+        max_score: float = 1.0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Selects the most similar other hazards for each row of the similarity matrix, keeping only
+        scores strictly between min_score and max_score.
+
+        Args:
+            similarity_matrix (numpy.ndarray): The similarity matrix representing the pairwise similarity scores.
+            top_k (int): The number of hazards to select per row, defaults to the top_k attribute.
+            min_score (float): Scores at or below this value are ignored, defaults to the threshold
+                attribute.
+            max_score (float): Scores at or above this value are ignored.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The column indices of the selected hazards per row, most
+            similar first and -1 where fewer than top_k hazards pass the thresholds, and their scores.
+        """
+        top_k = self.top_k if top_k is None else top_k
+        min_score = self.threshold if min_score is None else min_score
+
+        scores = np.array(similarity_matrix, dtype=np.float64)
+        if scores.shape[0] == scores.shape[1]:
+            np.fill_diagonal(scores, -np.inf)
+        scores[(scores <= min_score) | (scores >= max_score)] = -np.inf
+
+        return top_k_rows(scores, top_k)
+
     def generate_confused_hazards(
-        self, similarity_matrix: np.ndarray, similarity_pairs_df: pd.DataFrame
+        self, similarity_matrix: np.ndarray, top_k: int = None
     ) -> pd.DataFrame:
         """
         Creates a dataframe with the most similar hazards for each hazard.
 
         Args:
             similarity_matrix (numpy.ndarray): The similarity matrix representing the pairwise similarity scores.
-            similarity_pairs_df (pandas.DataFrame): The DataFrame containing the similarity pairs.
+            top_k (int): The number of most similar hazards to keep for each hazard, defaults to the
+                top_k attribute.
 
         Returns:
             pandas.DataFrame: A DataFrame containing the hazard codes and their most similar hazards.
         """
-        confused_hazards = []
-        for i in range(similarity_matrix.shape[0]):
-            most_similar_hazards = (
-                similarity_pairs_df[
-                    similarity_pairs_df["Hazard_Code_1"] == self.hazard_df["Hazard_Code"].iloc[i]
-                ]
-                .nlargest(3, "Similarity_Score")["Hazard_Code_2"]
-                .tolist()
-            )
-            confused_hazards.append(", ".join(most_similar_hazards))
+        top_indices, _ = self.select_top_confused(similarity_matrix, top_k)
+        hazard_codes = self.hazard_df["Hazard_Code"].to_numpy()
+        confused_hazards = [", ".join(hazard_codes[row[row >= 0]]) for row in top_indices]
 
         confusion_df = pd.DataFrame(
             {
@@ -177,14 +961,26 @@ class ConfusionMatrixGenerator:
 
         return confusion_df
 
+    def save_table(self, table: pd.DataFrame, name: str) -> None:
+        """
+        Saves a table to the output folder in the output format, and as Excel if export_excel is set.
+
+        Args:
+            table (pandas.DataFrame): The table to be saved.
+            name (str): The file name without extension.
+        """
+        write_table(table, f"{self.output_folder}/{name}.{self.output_format}")
+        if self.export_excel and self.output_format != "xlsx":
+            write_table(table, f"{self.output_folder}/{name}.xlsx")
+
     def save_confused_pairs(self, confused_pairs_df: pd.DataFrame) -> None:
         """
-        Saves the confused pairs as Excel and JSON files.
+        Saves the confused pairs as a table in the output format and as a JSON file.
 
         Args:
             confused_pairs_df (pandas.DataFrame): The DataFrame containing the confused pairs.
         """
-        confused_pairs_df.to_excel(f"{self.output_folder}/confusion_list.xlsx")
+        self.save_table(confused_pairs_df, "confusion_list")
         confused_pairs_df.to_json(f"{self.output_folder}/confusion_list.json", orient="records")
 
     def add_confused_to_definitions(
@@ -210,6 +1006,8 @@ class ConfusionMatrixGenerator:
             similarity_matrix (np.ndarray): The similarity matrix to be visualized.
             labels_list (List[str]): The list of labels for the heatmap.
         """
+        import plotly.graph_objects as go
+
         # Mask the upper half of the similarity matrix
         mask = np.triu(np.ones_like(similarity_matrix, dtype=bool))
         similarity_matrix[mask] = None
@@ -232,13 +1030,21 @@ class ConfusionMatrixGenerator:
 
         fig.show()
 
+    def compute_similarity_matrix(self) -> np.ndarray:
+        """
+        Computes the similarity matrix of the hazard descriptions.
+
+        Returns:
+            np.ndarray: The similarity matrix, one row and column per hazard.
+        """
+        # Use cosine similarity to compare each hazard description pair
+        return cosine_similarity(self.encode_descriptions())
+
     def run_plotly_heatmap(self) -> None:
         """
         Runs the ConfusionMatrixGenerator to generate and display an interactive heatmap using Plotly.
         """
-        # Use cosine similarity to compare each hazard description pair
-        embeddings = self.model.encode(self.hazard_df["Hazard_Description"].tolist())
-        similarity_matrix = cosine_similarity(embeddings)
+        similarity_matrix = self.compute_similarity_matrix()
 
         # Create the labels for the heatmap (Hazard Code and Hazard Name)
         labels_list = (
@@ -248,38 +1054,506 @@ class ConfusionMatrixGenerator:
         # Create the interactive heatmap using plotly.graph_objects
         self.show_plotly_heatmap(similarity_matrix, labels_list)
 
-    def run(self) -> None:
+    def run(self, heatmap: bool = True) -> None:
         """
         Runs the ConfusionMatrixGenerator to generate and save the confusion matrix and other outputs.
-        """
-        # Use cosine similarity to compare each hazard description pair
-        embeddings = self.model.encode(self.hazard_df["Hazard_Description"].tolist())
-        similarity_matrix = cosine_similarity(embeddings)
 
-        line_positions_ordered = self.find_category_lines(self.hazard_df["Hazard_Category"])
+        Args:
+            heatmap (bool): Whether to draw the heatmap, which needs seaborn and matplotlib.
+        """
+        similarity_matrix = self.compute_similarity_matrix()
 
-        self.visualize_heatmap(similarity_matrix, line_positions_ordered)
+        if heatmap:
+            line_positions_ordered = self.find_category_lines(self.hazard_df["Hazard_Category"])
+            self.visualize_heatmap(similarity_matrix, line_positions_ordered)
         self.save_similarity_matrix(similarity_matrix)
 
-        # Create pairs of hazard codes and their similarity scores
-        pairs_df = self.generate_similarity_pairs(similarity_matrix)
-        filtered_pairs_df = self.filter_similarity_pairs(pairs_df)
-        confusion_df = self.generate_confused_hazards(similarity_matrix, filtered_pairs_df)
+        # Select the top_k most similar hazards for each hazard
+        confusion_df = self.generate_confused_hazards(similarity_matrix)
         # self.save_confused_pairs(confusion_df)
 
-        updated_hazard_definitions = self.hazard_df.merge(confusion_df, on="Hazard_Code")
+        self.save_similarity_state(similarity_matrix, confusion_df["Confused_Hazards"])
+        self.save_updated_definitions(confusion_df)
+
+    def run_chunked(self, top_k: int = None, chunk_size: int = 1024) -> None:
+        """
+        Runs the ConfusionMatrixGenerator in blocks, for taxonomies too large to hold the dense
+        similarity matrix in memory. The matrix is written block by block to confusion_matrix.npy
+        and the confused hazards are selected with a streaming top-k, so no heatmap is drawn.
+
+        Args:
+            top_k (int): The number of most similar hazards to keep for each hazard, defaults to the
+                top_k attribute.
+            chunk_size (int): The number of hazards compared per block, which bounds peak memory.
+        """
+        embeddings = self.encode_descriptions()
+        write_similarity_matrix(
+            embeddings, f"{self.output_folder}/confusion_matrix.npy", chunk_size
+        )
+
+        top_indices, _ = chunked_top_k(
+            embeddings,
+            embeddings,
+            self.top_k if top_k is None else top_k,
+            chunk_size,
+            min_score=self.threshold,
+            max_score=1.0,
+            exclude_self=True,
+        )
+        hazard_codes = self.hazard_df["Hazard_Code"].to_numpy()
+        confusion_df = pd.DataFrame(
+            {
+                "Hazard_Code": self.hazard_df["Hazard_Code"],
+                "Confused_Hazards": [", ".join(hazard_codes[row[row >= 0]]) for row in top_indices],
+            }
+        )
+        self.save_updated_definitions(confusion_df)
+
+    def save_updated_definitions(self, confusion_df: pd.DataFrame) -> None:
+        """
+        Saves the hazard definitions with their Confused_Hazards replaced by the given ones.
+
+        Args:
+            confusion_df (pandas.DataFrame): The DataFrame containing the confused hazards.
+        """
+        # Replace any Confused_Hazards column already in the definitions rather than duplicating it
+        updated_hazard_definitions = self.hazard_df.drop(
+            columns="Confused_Hazards", errors="ignore"
+        ).merge(confusion_df, on="Hazard_Code")
+
+        self.save_table(updated_hazard_definitions, "hazard_definitions")
+
+    def save_similarity_state(
+        self, similarity_matrix: np.ndarray, confused_hazards: pd.Series
+    ) -> None:
+        """
+        Saves the similarity matrix and confused hazards with the hazard codes and description
+        hashes they were computed from, so a later incremental run can tell what changed.
+
+        Args:
+            similarity_matrix (np.ndarray): The similarity matrix to be saved.
+            confused_hazards (pd.Series): The Confused_Hazards of each hazard.
+        """
+        np.savez(
+            f"{self.output_folder}/similarity_state.npz",
+            model=np.array(self.model_name),
+            hazard_codes=self.hazard_df["Hazard_Code"].to_numpy(dtype=str),
+            description_hashes=np.array(self.description_hashes()),
+            similarity_matrix=similarity_matrix,
+            confused_hazards=confused_hazards.to_numpy(dtype=str),
+        )
+
+    def load_similarity_state(self) -> dict:
+        """
+        Loads the similarity state saved by the previous run.
+
+        Returns:
+            dict: The previous model name, hazard codes, description hashes, similarity matrix and
+            confused hazards, or None if there is no previous state for the current model.
+        """
+        state_path = f"{self.output_folder}/similarity_state.npz"
+        if not os.path.exists(state_path):
+            return None
+        with np.load(state_path) as state:
+            if str(state["model"]) != self.model_name:
+                return None
+            return {key: state[key] for key in state.files}
+
+    def description_hashes(self) -> List[str]:
+        """
+        Returns the hash of every hazard description, in hazard order.
+        """
+        return [
+            EmbeddingCache.hash_text(description)
+            for description in self.hazard_df["Hazard_Description"]
+        ]
+
+    def update_similarity_matrix(
+        self, embeddings: np.ndarray, previous_state: dict
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Updates the previous similarity matrix to the current hazards, recomputing only the rows
+        and columns of hazards that are new or whose description changed.
+
+        Args:
+            embeddings (np.ndarray): The current hazard description embeddings.
+            previous_state (dict): The state loaded by load_similarity_state.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The updated similarity matrix and the positions of the
+            hazards that were recomputed.
+        """
+        previous_positions = {
+            (hazard_code, description_hash): i
+            for i, (hazard_code, description_hash) in enumerate(
+                zip(previous_state["hazard_codes"], previous_state["description_hashes"])
+            )
+        }
+        positions = np.array(
+            [
+                previous_positions.get(key, -1)
+                for key in zip(self.hazard_df["Hazard_Code"], self.description_hashes())
+            ]
+        )
+        changed = np.flatnonzero(positions < 0)
+        unchanged = np.flatnonzero(positions >= 0)
+
+        similarity_matrix = np.empty((len(positions), len(positions)))
+        similarity_matrix[np.ix_(unchanged, unchanged)] = previous_state["similarity_matrix"][
+            np.ix_(positions[unchanged], positions[unchanged])
+        ]
+        if changed.size:
+            changed_rows = cosine_similarity(embeddings[changed], embeddings)
+            similarity_matrix[changed, :] = changed_rows
+            similarity_matrix[:, changed] = changed_rows.T
+
+        return similarity_matrix, changed
 
-        updated_hazard_definitions.to_excel(
-            f"{self.output_folder}/hazard_definitions.xlsx", index=False
+    def run_incremental(self, heatmap: bool = True) -> List[str]:
+        """
+        Runs the ConfusionMatrixGenerator against the state of the previous run, recomputing only
+        the similarities of new or edited hazards and only updating the Confused_Hazards of hazards
+        whose list actually changed. Falls back to a full run if there is no previous state.
+
+        Args:
+            heatmap (bool): Whether a fallback full run also draws the heatmap.
+
+        Returns:
+            List[str]: The codes of the hazards whose Confused_Hazards changed.
+        """
+        previous_state = self.load_similarity_state()
+        if previous_state is None:
+            self.run(heatmap=heatmap)
+            return self.hazard_df["Hazard_Code"].tolist()
+
+        embeddings = self.encode_descriptions()
+        similarity_matrix, _ = self.update_similarity_matrix(embeddings, previous_state)
+        self.save_similarity_matrix(similarity_matrix)
+        confusion_df = self.generate_confused_hazards(similarity_matrix)
+
+        previous_confused = dict(
+            zip(previous_state["hazard_codes"], previous_state["confused_hazards"])
         )
+        updated = np.array(
+            [
+                previous_confused.get(hazard_code) != confused_hazards
+                for hazard_code, confused_hazards in zip(
+                    confusion_df["Hazard_Code"], confusion_df["Confused_Hazards"]
+                )
+            ],
+            dtype=bool,
+        )
+
+        self.save_similarity_state(similarity_matrix, confusion_df["Confused_Hazards"])
+        if updated.any() or len(previous_confused) != len(confusion_df):
+            self.save_updated_definitions(confusion_df)
+
+        return confusion_df.loc[updated, "Hazard_Code"].tolist()
+
+
+FUSION_METHODS = ["mean", "max", "rank"]
+
+
+def fuse_similarity_matrices(similarity_matrices: List[np.ndarray], fusion: str) -> np.ndarray:
+    """
+    Combines the similarity matrices of several models into one.
 
+    "mean" and "max" combine the similarities element-wise. "rank" orders each row by reciprocal
+    rank fusion of the per-model rankings, then assigns that row's mean similarities in the fused
+    order, so the similarity thresholds keep their meaning.
 
-data_file = "../data/hazard_definitions.xlsx"
-output_folder = "data"
-confusion_matrix_generator = ConfusionMatrixGenerator("all-mpnet-base-v2", data_file, output_folder)
+    Args:
+        similarity_matrices (List[np.ndarray]): The similarity matrices, all of the same shape.
+        fusion (str): The fusion method, one of FUSION_METHODS.
+
+    Returns:
+        np.ndarray: The fused similarity matrix.
+    """
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSION_METHODS}")
+    stacked = np.stack(similarity_matrices)
+    if fusion == "max":
+        return stacked.max(axis=0)
+    mean = stacked.mean(axis=0)
+    if fusion == "mean":
+        return mean
+
+    # rank 0 is the most similar column of a row, 60 is the usual reciprocal rank fusion constant
+    ranks = np.argsort(np.argsort(-stacked, axis=2, kind="stable"), axis=2, kind="stable")
+    fused_order = np.argsort(-(1 / (60 + ranks + 1)).sum(axis=0), axis=1, kind="stable")
+    fused = np.empty_like(mean)
+    np.put_along_axis(fused, fused_order, -np.sort(-mean, axis=1), axis=1)
+    return fused
+
+
+def top_k_agreement(reference: np.ndarray, candidate: np.ndarray) -> Tuple[float, float]:
+    """
+    Compares two top-k selections, such as those returned by select_top_confused.
+
+    Args:
+        reference (np.ndarray): The reference column indices per row, -1 for no selection.
+        candidate (np.ndarray): The candidate column indices per row, -1 for no selection.
+
+    Returns:
+        Tuple[float, float]: The mean Jaccard overlap of the selected sets per row, and the
+        fraction of rows whose selections are identical in order.
+    """
+    overlaps = []
+    for reference_row, candidate_row in zip(reference, candidate):
+        reference_set = set(reference_row[reference_row >= 0])
+        candidate_set = set(candidate_row[candidate_row >= 0])
+        union = reference_set | candidate_set
+        overlaps.append(len(reference_set & candidate_set) / len(union) if union else 1.0)
+    exact = np.mean([np.array_equal(a, b) for a, b in zip(reference, candidate)])
+    return float(np.mean(overlaps)), float(exact)
+
+
+class EnsembleConfusionMatrixGenerator(ConfusionMatrixGenerator):
+    """
+    A ConfusionMatrixGenerator that combines the description similarities of several sentence
+    transformer models, encoding the descriptions once per model through each model's embedding
+    cache.
+
+    With "mean" fusion the ensemble also has one set of embeddings: each model's unit-length
+    embeddings scaled by 1/sqrt(n) and concatenated, whose cosine similarity is the mean of the
+    per-model ones. Methods built on encode_descriptions (run_chunked, run_incremental,
+    quantize_embeddings and build_embedding_index) need it, so they reject the other fusions.
+
+    Attributes:
+        model_names (List[str]): The names or paths of the sentence transformer models.
+        fusion (str): How the similarity matrices are combined, one of FUSION_METHODS.
+        generators (List[ConfusionMatrixGenerator]): One generator per model, sharing hazard_df.
+        model_report (pandas.DataFrame): The per-model timing and agreement of the last run.
+
+    Methods:
+        encode_texts: Encodes texts with every model into the concatenated embeddings.
+        encode_descriptions: Returns the concatenated description embeddings of every model.
+        compute_similarity_matrix: Computes the fused similarity matrix and the model report.
+        run: Runs the generator and saves the model report.
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        data_file_path: str,
+        output_folder: str,
+        fusion: str = "mean",
+        **kwargs,
+    ) -> None:
+        """
+        Initializes the EnsembleConfusionMatrixGenerator class.
+
+        Args:
+            models (List[str]): The names or paths of the sentence transformer models.
+            data_file_path (str): The file path of the data file containing hazard information.
+            output_folder (str): The folder path where the output files will be saved.
+            fusion (str): How the similarity matrices are combined, one of FUSION_METHODS.
+            **kwargs: The other ConfusionMatrixGenerator arguments, shared by every model.
+        """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion {fusion}, expected one of {FUSION_METHODS}")
+        super().__init__("+".join(models), data_file_path, output_folder, **kwargs)
+        self.model_names = list(models)
+        self.fusion = fusion
+        self.generators = []
+        for model in models:
+            generator = ConfusionMatrixGenerator(
+                model, data_file_path, output_folder, hazard_df=self.hazard_df, **kwargs
+            )
+            self.generators.append(generator)
+        self.model_report = None
+
+    def combine_embeddings(self, embeddings: List[np.ndarray]) -> np.ndarray:
+        """
+        Concatenates the embeddings of every model so their cosine similarity is the mean of the
+        per-model cosine similarities.
+
+        Args:
+            embeddings (List[np.ndarray]): The embeddings of each model, one row per text.
+
+        Returns:
+            np.ndarray: The concatenated embeddings, one unit-length row per text.
+        """
+        if self.fusion != "mean":
+            raise ValueError(f"Fusion {self.fusion} has no single set of embeddings, use mean")
+        scale = 1 / np.sqrt(len(embeddings))
+        return np.hstack(
+            [normalize_rows(model_embeddings) * scale for model_embeddings in embeddings]
+        )
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes texts with every model and concatenates the embeddings.
+
+        Args:
+            texts (List[str]): The texts to encode.
+
+        Returns:
+            np.ndarray: The concatenated embeddings, one row per text.
+        """
+        return self.combine_embeddings(
+            [generator.encode_texts(texts) for generator in self.generators]
+        )
+
+    def encode_descriptions(self) -> np.ndarray:
+        """
+        Returns the concatenated hazard description embeddings, read through each model's cache.
+
+        Returns:
+            np.ndarray: The concatenated embeddings, one row per hazard.
+        """
+        return self.combine_embeddings(
+            [generator.encode_descriptions() for generator in self.generators]
+        )
+
+    def compute_similarity_matrix(self) -> np.ndarray:
+        """
+        Computes the similarity matrix of each model and fuses them. Records the encoding and
+        similarity time of each model, and how well its top_k confused hazards agree with the
+        fused ones, in model_report.
+
+        Returns:
+            np.ndarray: The fused similarity matrix.
+        """
+        similarity_matrices, seconds = [], []
+        for generator in self.generators:
+            start = time.perf_counter()
+            similarity_matrices.append(generator.compute_similarity_matrix())
+            seconds.append(time.perf_counter() - start)
+        similarity_matrix = fuse_similarity_matrices(similarity_matrices, self.fusion)
+
+        fused_top, _ = self.select_top_confused(similarity_matrix)
+        rows = []
+        for model, model_matrix, model_seconds in zip(
+            self.model_names, similarity_matrices, seconds
+        ):
+            model_top, _ = self.select_top_confused(model_matrix)
+            jaccard, exact = top_k_agreement(fused_top, model_top)
+            rows.append(
+                {
+                    "Model": model,
+                    "Seconds": round(model_seconds, 3),
+                    "Top_K_Jaccard": round(jaccard, 4),
+                    "Top_K_Exact": round(exact, 4),
+                }
+            )
+            log_event("ensemble_model", fusion=self.fusion, top_k=self.top_k, **rows[-1])
+
+        self.model_report = pd.DataFrame(rows)
+        return similarity_matrix
+
+    def run(self, heatmap: bool = True) -> None:
+        """
+        Runs the ConfusionMatrixGenerator and also saves the model report as the model_report table.
+
+        Args:
+            heatmap (bool): Whether to draw the heatmap, which needs seaborn and matplotlib.
+        """
+        super().run(heatmap)
+        self.save_table(self.model_report, "model_report")
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments of the confusion matrix generator.
+
+    Args:
+        argv (List[str]): The arguments, defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Generate the hazard confusion matrix")
+    parser.add_argument(
+        "--model",
+        nargs="+",
+        default=["all-mpnet-base-v2"],
+        help="sentence transformer model, or several to combine as an ensemble",
+    )
+    parser.add_argument(
+        "--fusion", choices=FUSION_METHODS, default="mean", help="how an ensemble is combined"
+    )
+    parser.add_argument(
+        "--input", default="../data/hazard_definitions.xlsx", help="hazard definitions file"
+    )
+    parser.add_argument("--output", default="data", help="folder for the generated outputs")
+    parser.add_argument(
+        "--top-k", type=int, default=3, help="confused hazards to keep for each hazard"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.5, help="minimum similarity of a confused hazard"
+    )
+    parser.add_argument("--batch-size", type=int, default=32, help="descriptions encoded per batch")
+    parser.add_argument("--device", help="device to run the model on, such as cpu or cuda")
+    parser.add_argument("--threads", type=int, help="CPU threads used by torch while encoding")
+    parser.add_argument(
+        "--normalize", action="store_true", help="have the model return unit-length embeddings"
+    )
+    parser.add_argument("--log-level", default="INFO", help="level of the JSON progress logs")
+    parser.add_argument(
+        "--mode",
+        choices=["full", "chunked", "incremental", "plotly"],
+        default="full",
+        help="full run, bounded-memory run, update from the previous run, or interactive heatmap",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=1024, help="hazards per block in chunked mode"
+    )
+    parser.add_argument("--no-heatmap", action="store_true", help="skip drawing the heatmap")
+    parser.add_argument(
+        "--output-format", choices=TABLE_FORMATS, default="parquet", help="format of the tables"
+    )
+    parser.add_argument("--export-excel", action="store_true", help="also write Excel copies")
+    parser.add_argument(
+        "--quantize",
+        choices=QuantizedEmbeddingStore.DTYPES,
+        help="also write the embeddings as a float16 or int8 store and log its recall",
+    )
+    args = parser.parse_args(argv)
+    if len(args.model) > 1 and args.fusion != "mean":
+        if args.mode in ["chunked", "incremental"]:
+            parser.error(f"--mode {args.mode} with several models needs --fusion mean")
+        if args.quantize:
+            parser.error("--quantize with several models needs --fusion mean")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+    os.makedirs(args.output, exist_ok=True)
+    generator_options = dict(
+        output_format=args.output_format,
+        export_excel=args.export_excel,
+        top_k=args.top_k,
+        threshold=args.threshold,
+        batch_size=args.batch_size,
+        device=args.device,
+        threads=args.threads,
+        normalize=args.normalize,
+    )
+    if len(args.model) > 1:
+        confusion_matrix_generator = EnsembleConfusionMatrixGenerator(
+            args.model, args.input, args.output, fusion=args.fusion, **generator_options
+        )
+    else:
+        confusion_matrix_generator = ConfusionMatrixGenerator(
+            args.model[0], args.input, args.output, **generator_options
+        )
 
-# Generate and save the confusion matrix and other outputs
-# confusion_matrix_generator.run()
+    if args.quantize:
+        confusion_matrix_generator.quantize_embeddings(args.quantize)
 
-# Generate and display an interactive heatmap using Plotly
-confusion_matrix_generator.run_plotly_heatmap()
+    if args.mode == "full":
+        # Generate and save the confusion matrix and other outputs
+        confusion_matrix_generator.run(heatmap=not args.no_heatmap)
+    elif args.mode == "chunked":
+        # Generate the confusion matrix and confused hazards in blocks, for large taxonomies
+        confusion_matrix_generator.run_chunked(chunk_size=args.chunk_size)
+    elif args.mode == "incremental":
+        # Update the confused hazards of only the hazards affected by edits since the last run
+        changed = confusion_matrix_generator.run_incremental(heatmap=not args.no_heatmap)
+        print(f"Updated the confused hazards of {len(changed)} hazards: {', '.join(changed)}")
+    else:
+        # Generate and display an interactive heatmap using Plotly
+        confusion_matrix_generator.run_plotly_heatmap()
@@ -2,5 +2,4 @@
 
 cd "$(dirname "$0")"
 # Run
-command="python3 ConfusionMatrix.py"
-$command
\ No newline at end of file
+python3 ConfusionMatrix.py "$@"
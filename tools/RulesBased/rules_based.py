@@ -2,14 +2,349 @@
 Uses rules based matching to guide the user through identifying the hazards in the event report.
 """
 
+import os
+import re
+import sys
+import csv
+import json
 import string
+import heapq
+import hashlib
+import argparse
+import functools
+import itertools
+import collections
+import multiprocessing
 import nltk
+import numpy as np
+import openpyxl
 import pandas as pd
 import warnings
 
 # remove redundant pandas warning
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
+# bump whenever the layout of the compiled hazard definitions changes
+DEFINITIONS_ARTIFACT_VERSION = 4
+
+# comma separated definition columns that are compiled into lists of hazard codes
+LIST_COLUMNS = ["Upstream_Hazards", "Excluded_Hazards", "Confused_Hazards"]
+
+# comma separated definition columns that are compiled into tokenized phrases to match reports on
+PHRASE_COLUMNS = ["Keywords", "Synonyms"]
+
+# parenthesised asides in Synonyms cells, such as citations "(WMO, 2021)" and acronyms
+PARENTHESISED_PATTERN = re.compile(r"\([^()]*\)")
+
+# longer Synonyms fragments are prose from the definition rather than names of the hazard
+MAX_SYNONYM_WORDS = 4
+
+# same pattern as natural.WordTokenizer in the API, so both paths tokenize reports identically
+WORD_SPLIT_PATTERN = re.compile(r"[^A-Za-zА-Яа-я0-9_]+")
+
+# set once the Punkt resources have been found or downloaded in this process
+_punkt_ready = False
+
+
+def regex_tokenize(text):
+    """
+    Splits text into words on runs of characters that are not letters, digits or underscores.
+    """
+    return [word for word in WORD_SPLIT_PATTERN.split(text) if word]
+
+
+def punkt_tokenize(text):
+    """
+    Tokenizes text with nltk's Punkt based word tokenizer, fetching its resources on first use.
+    """
+    global _punkt_ready
+    if not _punkt_ready:
+        try:
+            nltk.data.find("tokenizers/punkt")
+        except LookupError:
+            nltk.download("punkt", quiet=True)
+        _punkt_ready = True
+    return nltk.word_tokenize(text)
+
+
+TOKENIZERS = {"regex": regex_tokenize, "punkt": punkt_tokenize}
+
+# inflectional endings stripped by normalise_token, longest first, with what replaces them
+INFLECTIONAL_SUFFIXES = [("ies", "y"), ("ing", ""), ("es", "e"), ("ed", ""), ("s", "")]
+
+# words ending in these are not plurals, e.g. "loss", "virus" and "crisis"
+NON_PLURAL_ENDINGS = ("ss", "us", "is")
+
+# shortest word left after stripping an ending, so short words such as "aids" are kept whole
+MIN_STEM_LENGTH = 4
+
+
+@functools.lru_cache(maxsize=2**16)
+def normalise_token(token):
+    """
+    Strips the inflectional ending of a lowercased token, so "floods", "flooded" and "flooding"
+    all become "flood". Derivational endings are kept, unlike a Porter stem, so "organization"
+    never matches "organic". Memoised since reports share most words.
+    """
+    for suffix, replacement in INFLECTIONAL_SUFFIXES:
+        if suffix == "s" and token.endswith(NON_PLURAL_ENDINGS):
+            break
+        stem = token[: -len(suffix)]
+        if token.endswith(suffix) and len(stem) >= MIN_STEM_LENGTH:
+            return stem + replacement
+    return token
+
+
+class KeywordIndex:
+    """
+    Index from keyword phrases to keyword ids.
+
+    Multi-word keywords are stored as token tuples, so every keyword is found in a single
+    pass over the report tokens. With a normaliser, keywords are stored by their normal form
+    and report tokens are normalised as they are scanned, so "floods" matches "flood".
+
+    Attributes:
+        phrases (dict): Maps normalised keyword token tuples to keyword ids.
+        keywords (list): The keyword phrases as first listed, indexed by keyword id.
+        phrase_lengths (list): The distinct keyword lengths in tokens, in ascending order.
+        normaliser (callable): Maps a lowercased token to its normal form, or None.
+    """
+
+    def __init__(self, normaliser=None):
+        self.phrases = {}
+        self.keywords = []
+        self.phrase_lengths = []
+        self.normaliser = normaliser
+
+    def normalise(self, tokens):
+        """
+        Returns the normal forms of lowercased tokens.
+        """
+        if self.normaliser is None:
+            return tuple(tokens)
+        return tuple(self.normaliser(token) for token in tokens)
+
+    def add(self, keyword):
+        """
+        Adds a keyword phrase to the index.
+
+        Args:
+            keyword (str): The keyword phrase, with words separated by spaces.
+
+        Returns:
+            int: The id of the keyword, or None if the keyword is empty.
+        """
+        phrase = self.normalise(keyword.lower().split())
+        if not phrase:
+            return None
+        if phrase not in self.phrases:
+            self.phrases[phrase] = len(self.keywords)
+            self.keywords.append(keyword.lower())
+            if len(phrase) not in self.phrase_lengths:
+                self.phrase_lengths = sorted(self.phrase_lengths + [len(phrase)])
+        return self.phrases[phrase]
+
+    def find(self, tokens):
+        """
+        Finds the keywords present in the report tokens.
+
+        Args:
+            tokens (list): The lowercased report tokens.
+
+        Returns:
+            numpy.ndarray: The sorted ids of the keywords present in the report.
+        """
+        tokens = self.normalise(tokens)
+        found = set()
+        for start in range(len(tokens)):
+            for length in self.phrase_lengths:
+                phrase = tuple(tokens[start : start + length])
+                if len(phrase) < length:
+                    break
+                if phrase in self.phrases:
+                    found.add(self.phrases[phrase])
+        return np.array(sorted(found), dtype=np.intp)
+
+
+class HazardMatcher:
+    """
+    Matches reports against every hazard's keyword rule at once.
+
+    A report is reduced to the sparse set of keyword ids it contains, which is evaluated
+    against a precompiled hazard x keyword matrix. Synonyms count as keywords ranked after
+    the hazard's Keywords. OR hazards need one of their keywords, AND
+    hazards need at least `and_keywords` of them, and a matched hazard is dropped when a hazard it
+    excludes, or that excludes it, is matched on more keywords.
+
+    Attributes:
+        hazard_codes (list): The hazard codes in hazard definition order.
+        keyword_index (KeywordIndex): Index from keyword phrases to keyword ids.
+        keyword_rank (numpy.ndarray): Hazard x keyword matrix holding the position of each keyword
+            in the hazard's keyword list, or NO_KEYWORD where the hazard does not list it.
+        required (numpy.ndarray): The number of distinct keywords each hazard needs.
+        exclusion_matrix (numpy.ndarray): Symmetric hazard x hazard matrix, True where either
+            hazard lists the other in its Excluded_Hazards.
+    """
+
+    NO_KEYWORD = np.iinfo(np.int32).max
+
+    def __init__(self, hazard_definitions, and_keywords=2, normalise=True):
+        """
+        Compiles the matcher from a hazard definitions DataFrame.
+
+        Args:
+            hazard_definitions (pandas.DataFrame): Definitions with Hazard_Code and Keywords lists,
+                and optionally Synonyms lists, Keywords_Operator and Excluded_Hazards lists.
+            and_keywords (int): The number of keywords an AND hazard needs, capped at the number
+                of keywords it has.
+            normalise (bool): Whether to match keywords and report tokens without their
+                inflectional endings.
+        """
+        self.hazard_codes = hazard_definitions["Hazard_Code"].tolist()
+        self.keyword_index = KeywordIndex(normalise_token if normalise else None)
+        phrases = hazard_definitions["Keywords"].tolist()
+        if "Synonyms" in hazard_definitions.columns:
+            phrases = [
+                keywords + (synonyms if isinstance(synonyms, list) else [])
+                for keywords, synonyms in zip(phrases, hazard_definitions["Synonyms"])
+            ]
+        keyword_ids = [[self.keyword_index.add(phrase) for phrase in row] for row in phrases]
+
+        self.keyword_rank = np.full(
+            (len(self.hazard_codes), len(self.keyword_index.keywords)), self.NO_KEYWORD, np.int32
+        )
+        for hazard_position, ids in enumerate(keyword_ids):
+            for rank, keyword_id in reversed(list(enumerate(ids))):
+                if keyword_id is not None:
+                    self.keyword_rank[hazard_position, keyword_id] = rank
+
+        keyword_counts = (self.keyword_rank != self.NO_KEYWORD).sum(axis=1)
+        is_and = np.zeros(len(self.hazard_codes), bool)
+        if "Keywords_Operator" in hazard_definitions.columns:
+            is_and = (hazard_definitions["Keywords_Operator"] == "AND").to_numpy()
+        self.required = np.where(is_and, np.minimum(and_keywords, keyword_counts), 1)
+        self.required = np.maximum(self.required, 1)
+
+        positions = {hazard_code: i for i, hazard_code in enumerate(self.hazard_codes)}
+        self.exclusion_matrix = np.zeros((len(self.hazard_codes), len(self.hazard_codes)), bool)
+        if "Excluded_Hazards" in hazard_definitions.columns:
+            for hazard_position, excluded in enumerate(hazard_definitions["Excluded_Hazards"]):
+                for hazard_code in excluded if isinstance(excluded, list) else []:
+                    if hazard_code in positions:
+                        self.exclusion_matrix[hazard_position, positions[hazard_code]] = True
+        # the definitions list some exclusions one way only, e.g. Cold Wave excludes Heatwave
+        self.exclusion_matrix |= self.exclusion_matrix.T
+
+    def match(self, tokens):
+        """
+        Finds the hazards whose keyword rules are satisfied by the report tokens.
+
+        Args:
+            tokens (list): The lowercased report tokens.
+
+        Returns:
+            list: (hazard code, first matching keyword) tuples, in hazard definition order.
+        """
+        present = self.keyword_index.find(tokens)
+        if not present.size:
+            return []
+
+        ranks = self.keyword_rank[:, present]
+        hits = (ranks != self.NO_KEYWORD).sum(axis=1)
+        matched = hits >= self.required
+        rival_hits = np.where(self.exclusion_matrix & matched, hits, 0).max(axis=1)
+        matched &= hits >= rival_hits
+
+        first_keyword = present[ranks.argmin(axis=1)]
+        return [
+            (self.hazard_codes[i], self.keyword_index.keywords[first_keyword[i]])
+            for i in np.flatnonzero(matched)
+        ]
+
+
+class HazardGraph:
+    """
+    Directed graph of the upstream relationships between hazards.
+
+    Attributes:
+        downstream (dict): Maps each hazard code to the hazards that list it as an upstream hazard.
+        order (dict): Maps each hazard code to its position in a topological order, so upstream
+            hazards come before the hazards they cause.
+        cycles (list): Hazard codes in, or downstream of, an upstream cycle, in definition order.
+    """
+
+    def __init__(self, upstream_hazards):
+        """
+        Builds the graph from the upstream hazards of each hazard.
+
+        Args:
+            upstream_hazards (dict): Maps hazard codes, in definition order, to their upstream
+                hazard codes.
+        """
+        self.downstream = {hazard_code: [] for hazard_code in upstream_hazards}
+        in_degree = dict.fromkeys(upstream_hazards, 0)
+        for hazard_code, upstream in upstream_hazards.items():
+            # self references and unknown codes in the definitions carry no ordering information
+            for upstream_code in dict.fromkeys(upstream):
+                if upstream_code != hazard_code and upstream_code in self.downstream:
+                    self.downstream[upstream_code].append(hazard_code)
+                    in_degree[hazard_code] += 1
+
+        # Kahn's algorithm, breaking ties by definition order
+        position = {hazard_code: i for i, hazard_code in enumerate(upstream_hazards)}
+        ready = [(position[code], code) for code, degree in in_degree.items() if degree == 0]
+        heapq.heapify(ready)
+        self.order = {}
+        while ready:
+            _, hazard_code = heapq.heappop(ready)
+            self.order[hazard_code] = len(self.order)
+            for downstream_code in self.downstream[hazard_code]:
+                in_degree[downstream_code] -= 1
+                if in_degree[downstream_code] == 0:
+                    heapq.heappush(ready, (position[downstream_code], downstream_code))
+
+        self.cycles = [code for code in upstream_hazards if code not in self.order]
+        if self.cycles:
+            warnings.warn(f"Upstream hazard cycle between {', '.join(self.cycles)}")
+            for hazard_code in self.cycles:
+                self.order[hazard_code] = len(self.order)
+
+    @classmethod
+    def from_definitions(cls, hazard_definitions):
+        """
+        Builds the graph from a hazard definitions DataFrame.
+
+        Args:
+            hazard_definitions (pandas.DataFrame): Definitions with Upstream_Hazards lists.
+
+        Returns:
+            HazardGraph: The upstream hazard graph.
+        """
+        return cls(
+            {row.Hazard_Code: row.Upstream_Hazards for row in hazard_definitions.itertuples()}
+        )
+
+
+# identifier used by the batch worker processes, inherited from the parent when forking
+_worker_identifier = None
+
+
+def _init_worker(definitions_path, artifact_path, tokenizer, normalise):
+    """
+    Loads the compiled hazard definitions in a worker process that did not inherit them.
+    """
+    global _worker_identifier
+    if _worker_identifier is None:
+        _worker_identifier = HazardIdentifier(definitions_path, artifact_path, tokenizer, normalise)
+        _worker_identifier.load_hazard_definitions()
+
+
+def _classify_chunk(reports):
+    """
+    Classifies a chunk of reports in a worker process.
+    """
+    return [_worker_identifier.classify_report(report) for report in reports]
+
 
 class HazardIdentifier:
     """
@@ -19,28 +354,61 @@ class HazardIdentifier:
         hazard_definitions_pd (pandas.DataFrame): DataFrame containing hazard definitions.
         category_wordlist (dict): Dictionary containing category wordlists.
         report (str): Event report text.
+        hazard_matcher (HazardMatcher): Matcher for the hazards' keyword rules.
+        hazard_graph (HazardGraph): Graph of upstream hazard relationships.
+        tokenizer (str): The name of the tokenizer in TOKENIZERS used for reports and keywords.
+        normalise (bool): Whether keywords and report tokens are matched without their
+            inflectional endings.
         identified_categories (list): List of identified hazard categories.
         self.identified_hazards (list): List of identified hazards.
 
     Methods:
-        load_hazard_definitions: Loads hazard definitions from a JSON file and an Excel file.
+        load_hazard_definitions: Loads the compiled hazard definitions, recompiling them if stale.
+        compile_hazard_definitions: Compiles the Excel hazard definitions into a JSON artifact.
+        tokenize_keywords: Splits a Keywords cell into keyword phrases.
+        tokenize_synonyms: Splits a Synonyms cell into phrases, dropping citations and prose.
+        get_hazard_matcher: Returns the keyword rule matcher, building it if needed.
+        get_hazard_graph: Returns the upstream hazard graph, building it if needed.
         load_category_wordlist: Loads category wordlists from a JSON file.
         load_event_report: Loads the event report from a text file.
         tokenize_report: Tokenizes the event report.
+        tokenize_text: Tokenizes and lowercases a piece of text.
         identify_categories: Identifies hazard categories based on the category wordlists.
         identify_hazards: Identifies hazards based on the hazard definitions and user input.
+        follow_upstream_hazards: Asks about the hazards downstream of newly identified hazards.
+        ask_hazard_question: Asks the user whether a hazard is present and records the answer.
+        classify_report: Finds the candidate hazards in a report without user input.
+        classify_reports: Finds the candidate hazards in many reports, optionally in parallel.
+        iter_reports: Reads reports one at a time from a JSONL, JSON, CSV or xlsx file.
+        write_batch_results: Writes the candidate hazards of each report as they are produced.
+        run_batch: Classifies every report in a file without user input.
         print_identified_hazards: Prints the identified hazards.
         run: Executes the hazard identification process.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        definitions_path="../data/hazard_definitions.xlsx",
+        artifact_path=None,
+        tokenizer="regex",
+        normalise=True,
+    ):
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f"Unknown tokenizer {tokenizer}, expected one of {list(TOKENIZERS)}")
+        self.definitions_path = definitions_path
+        self.artifact_path = artifact_path or (
+            os.path.splitext(definitions_path)[0] + ".compiled.json"
+        )
         self.hazard_definitions_pd = None
         self.category_wordlist = None
         self.report = None
         self.report_excel = None
         self.identified_hazards = set()
         self.rejected_hazards = set()
-        nltk.download('punkt')
+        self.hazard_matcher = None
+        self.hazard_graph = None
+        self.tokenizer = tokenizer
+        self.normalise = normalise
 
     def load_report_excel(self, file_path):
         """
@@ -50,32 +418,147 @@ class HazardIdentifier:
 
     def load_hazard_definitions(self):
         """
-        Loads hazard definitions from a JSON file and an Excel file.
+        Loads the compiled hazard definitions, recompiling them if the Excel file has changed.
+        Without the Excel file, the artifact must match the artifact version and tokenizer.
+        """
+        artifact = None
+        if os.path.exists(self.artifact_path):
+            with open(self.artifact_path, "r", encoding="UTF-8") as f:
+                artifact = json.load(f)
+
+        # the artifact is shipped on its own to workers that do not have the Excel file
+        if os.path.exists(self.definitions_path) and (
+            artifact is None
+            or artifact.get("version") != DEFINITIONS_ARTIFACT_VERSION
+            or artifact.get("tokenizer") != self.tokenizer
+            or artifact.get("source_hash") != self.hash_file(self.definitions_path)
+        ):
+            artifact = self.compile_hazard_definitions()
+        elif artifact is None:
+            raise FileNotFoundError(f"Hazard definitions not found at {self.definitions_path}")
+        elif (
+            artifact.get("version") != DEFINITIONS_ARTIFACT_VERSION
+            or artifact.get("tokenizer") != self.tokenizer
+        ):
+            raise ValueError(
+                f"Compiled hazard definitions at {self.artifact_path} are version"
+                f" {artifact.get('version')} for the {artifact.get('tokenizer')} tokenizer, expected"
+                f" version {DEFINITIONS_ARTIFACT_VERSION} for the {self.tokenizer} tokenizer"
+            )
+
+        self.hazard_definitions_pd = pd.DataFrame(artifact["hazards"])
+        self.hazard_matcher = HazardMatcher(self.hazard_definitions_pd, normalise=self.normalise)
+        self.hazard_graph = HazardGraph.from_definitions(self.hazard_definitions_pd)
+
+    def compile_hazard_definitions(self):
         """
-        self.hazard_definitions_pd = pd.read_excel("../data/hazard_definitions.xlsx")
+        Compiles the Excel hazard definitions into a JSON artifact, with tokenized keywords and
+        synonyms and the comma separated hazard code columns split into lists.
 
-        for i in range(len(self.hazard_definitions_pd)):
-            if not pd.isna(self.hazard_definitions_pd["Keywords"][i]):
-                self.hazard_definitions_pd["Keywords"][i] = nltk.word_tokenize(
-                    self.hazard_definitions_pd["Keywords"][i]
+        Returns:
+            dict: The compiled artifact, also written to the artifact path.
+        """
+        hazard_df = pd.read_excel(self.definitions_path)
+        hazard_df = hazard_df.astype(object).where(hazard_df.notna(), None)
+        for column in PHRASE_COLUMNS:
+            if column in hazard_df.columns:
+                tokenize = (
+                    self.tokenize_synonyms if column == "Synonyms" else self.tokenize_keywords
                 )
-                self.hazard_definitions_pd["Keywords"][i] = [
-                    word.lower() for word in self.hazard_definitions_pd["Keywords"][i]
-                ]
-                self.hazard_definitions_pd["Keywords"][i] = [
-                    word
-                    for word in self.hazard_definitions_pd["Keywords"][i]
-                    if word not in string.punctuation
+                hazard_df[column] = [tokenize(cell) for cell in hazard_df[column]]
+        for column in LIST_COLUMNS:
+            if column in hazard_df.columns:
+                hazard_df[column] = [
+                    (
+                        []
+                        if cell is None
+                        else [item.strip() for item in cell.split(",") if item.strip()]
+                    )
+                    for cell in hazard_df[column]
                 ]
-            else:
-                self.hazard_definitions_pd["Keywords"][i] = []
 
-            if not pd.isna(self.hazard_definitions_pd["Upstream_Hazards"][i]):
-                self.hazard_definitions_pd["Upstream_Hazards"][i] = self.hazard_definitions_pd[
-                    "Upstream_Hazards"
-                ][i].split(", ")
-            else:
-                self.hazard_definitions_pd["Upstream_Hazards"][i] = []
+        artifact = {
+            "version": DEFINITIONS_ARTIFACT_VERSION,
+            "tokenizer": self.tokenizer,
+            "source_hash": self.hash_file(self.definitions_path),
+            "hazards": hazard_df.to_dict(orient="records"),
+        }
+        # write to a temporary file first so a process loading concurrently never reads a torn one
+        temporary_path = f"{self.artifact_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="UTF-8") as f:
+            json.dump(artifact, f, separators=(",", ":"))
+        os.replace(temporary_path, self.artifact_path)
+        return artifact
+
+    @staticmethod
+    def hash_file(file_path):
+        """
+        Returns the SHA-256 hex digest of a file's contents.
+        """
+        with open(file_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def tokenize_keywords(self, keywords):
+        """
+        Splits a comma separated Keywords or Synonyms cell into lowercased keyword phrases.
+
+        Args:
+            keywords (str): The Keywords or Synonyms cell, which may be missing.
+
+        Returns:
+            list: The keyword phrases, with the words of multi-word keywords joined by spaces.
+        """
+        if pd.isna(keywords):
+            return []
+        phrases = []
+        for phrase in keywords.split(","):
+            words = [
+                word.lower()
+                for word in TOKENIZERS[self.tokenizer](phrase)
+                if word not in string.punctuation
+            ]
+            if words:
+                phrases.append(" ".join(words))
+        return phrases
+
+    def tokenize_synonyms(self, synonyms):
+        """
+        Splits a Synonyms cell into keyword phrases like tokenize_keywords, first removing
+        parenthesised asides and then dropping fragments that are only numbers or are longer than
+        MAX_SYNONYM_WORDS, as some cells hold prose with citations rather than a list of names.
+
+        Args:
+            synonyms (str): The Synonyms cell, which may be missing.
+
+        Returns:
+            list: The synonym phrases, with the words of multi-word synonyms joined by spaces.
+        """
+        if pd.isna(synonyms):
+            return []
+        phrases = self.tokenize_keywords(PARENTHESISED_PATTERN.sub(" ", synonyms))
+        return [
+            phrase
+            for phrase in phrases
+            if not phrase.replace(" ", "").isdigit() and len(phrase.split()) <= MAX_SYNONYM_WORDS
+        ]
+
+    def get_hazard_matcher(self):
+        """
+        Returns the keyword rule matcher, building it from the hazard definitions if needed.
+        """
+        if self.hazard_matcher is None:
+            self.hazard_matcher = HazardMatcher(
+                self.hazard_definitions_pd, normalise=self.normalise
+            )
+        return self.hazard_matcher
+
+    def get_hazard_graph(self):
+        """
+        Returns the upstream hazard graph, building it from the hazard definitions if needed.
+        """
+        if self.hazard_graph is None:
+            self.hazard_graph = HazardGraph.from_definitions(self.hazard_definitions_pd)
+        return self.hazard_graph
 
     def load_event_report(self):
         """
@@ -88,8 +571,13 @@ class HazardIdentifier:
         """
         Tokenizes the event report.
         """
-        self.report = nltk.word_tokenize(self.report)
-        self.report = [word.lower() for word in self.report]
+        self.report = self.tokenize_text(self.report)
+
+    def tokenize_text(self, text):
+        """
+        Tokenizes and lowercases a piece of text with the configured tokenizer.
+        """
+        return [word.lower() for word in TOKENIZERS[self.tokenizer](text)]
 
     def identify_hazards(self):
         """
@@ -99,64 +587,271 @@ class HazardIdentifier:
             print(
                 "After being asked each question, you will be asked for an input of (y/n/d/r)\n\n - Yes (y / 1) will add the hazard to the identified hazards\n - No (n / 2) will skip the hazard\n - Define (d / 3) will print the hazard description and ask for an input of (y/n)\n - Reason (r / 4) will print the word that suggests a hazard is present\n"
             )
-            for _ in range(3):
-                for row in self.hazard_definitions_pd.itertuples():
-                    for hazard in row.Upstream_Hazards:
-                        if (
-                            hazard in self.identified_hazards
-                            and hazard not in self.rejected_hazards
-                        ):
-                            print(f"Upstream hazard {hazard} already identified")
-                            print(f"{row.Questions} - {row.Hazard_Name}")
-                            response = input("(y/n/d/r): ")
-                            if response in ["yes", "y", "1"]:
-                                self.identified_hazards.add(row.Hazard_Code)
-                            elif response in ["define", "def", "d", "3"]:
-                                print(row.Hazard_Description)
-                                response = input("(y/n/r): ")
-                                if response in ["yes", "y", "1"]:
-                                    self.identified_hazards.add(row.Hazard_Code)
-                            elif response in ["reason", "r", "4"]:
-                                print(hazard)
-                                response = input("(y/n/r): ")
-                                if response in ["yes", "y", "1"]:
-                                    self.identified_hazards.add(row.Hazard_Code)
-
-                            if response in ["no", "n", "2", ""]:
-                                self.rejected_hazards.add(row.Hazard_Code)
-                            break
-
-                    if (
-                        row.Hazard_Code not in self.identified_hazards
-                        and row.Hazard_Code not in self.rejected_hazards
-                    ):
-                        for word in row.Keywords:
-                            if word.lower() in self.report:
-                                print(word)
-                                print(row.Questions)
-                                response = input("(y/n/d/r): ")
-                                if response in ["yes", "y", "1"]:
-                                    self.identified_hazards.add(row.Hazard_Code)
-                                elif response in ["define", "def", "d", "3"]:
-                                    print(row.Hazard_Description)
-                                    response = input("(y/n): ")
-                                    if response == "y":
-                                        self.identified_hazards.add(row.Hazard_Code)
-                                elif response in ["reason", "r", "4"]:
-                                    print(word)
-                                    response = input("(y/n/r): ")
-                                    if response in ["yes", "y", "1"]:
-                                        self.identified_hazards.add(row.Hazard_Code)
-
-                                if response in ["no", "n", "2", ""]:
-                                    self.rejected_hazards.add(row.Hazard_Code)
-                                break
+            rows = {row.Hazard_Code: row for row in self.hazard_definitions_pd.itertuples()}
+            self.follow_upstream_hazards(list(self.identified_hazards), rows)
+
+            for hazard_code, word in self.get_hazard_matcher().match(self.report):
+                if hazard_code in self.identified_hazards or hazard_code in self.rejected_hazards:
+                    continue
+                row = rows[hazard_code]
+                print(word)
+                print(row.Questions)
+                if self.ask_hazard_question(row, word):
+                    self.follow_upstream_hazards([hazard_code], rows)
+
             for hazard in self.identified_hazards:
                 print(hazard, end=", ")
             input("\nPress enter to continue")
         except KeyboardInterrupt:
             pass
 
+    def follow_upstream_hazards(self, hazards, rows):
+        """
+        Asks about the hazards downstream of newly identified hazards, following cascades to any
+        depth. Each hazard is only visited once one of its upstream hazards has been identified.
+
+        Args:
+            hazards (list): The newly identified hazard codes.
+            rows (dict): Maps hazard codes to their hazard definition rows.
+        """
+        hazard_graph = self.get_hazard_graph()
+        worklist = []
+        for hazard in hazards:
+            for downstream in hazard_graph.downstream.get(hazard, []):
+                heapq.heappush(worklist, (hazard_graph.order[downstream], downstream, hazard))
+
+        while worklist:
+            _, hazard_code, upstream = heapq.heappop(worklist)
+            if hazard_code in self.identified_hazards or hazard_code in self.rejected_hazards:
+                continue
+            row = rows[hazard_code]
+            print(f"Upstream hazard {upstream} already identified")
+            print(f"{row.Questions} - {row.Hazard_Name}")
+            if self.ask_hazard_question(row, upstream):
+                for downstream in hazard_graph.downstream[hazard_code]:
+                    heapq.heappush(
+                        worklist, (hazard_graph.order[downstream], downstream, hazard_code)
+                    )
+
+    def ask_hazard_question(self, row, reason):
+        """
+        Asks the user whether a hazard is present and records the answer.
+
+        Args:
+            row (tuple): The hazard definition row.
+            reason (str): The keyword or upstream hazard that suggests the hazard is present.
+
+        Returns:
+            bool: True if the hazard was identified.
+        """
+        response = input("(y/n/d/r): ")
+        if response in ["define", "def", "d", "3"]:
+            print(row.Hazard_Description)
+            response = input("(y/n/r): ")
+        elif response in ["reason", "r", "4"]:
+            print(reason)
+            response = input("(y/n/r): ")
+
+        if response in ["yes", "y", "1"]:
+            self.identified_hazards.add(row.Hazard_Code)
+            return True
+        if response in ["no", "n", "2", ""]:
+            self.rejected_hazards.add(row.Hazard_Code)
+        return False
+
+    def classify_report(self, report):
+        """
+        Finds the candidate hazards in a report without user input.
+
+        Args:
+            report (str): The event report text.
+
+        Returns:
+            list: (hazard code, triggering keyword) tuples, in hazard definition order.
+        """
+        return self.get_hazard_matcher().match(self.tokenize_text(report))
+
+    def classify_reports(self, reports, workers=1, chunk_size=256):
+        """
+        Finds the candidate hazards in many reports without user input.
+
+        With several workers the reports are split into chunks and classified by a process pool.
+        Workers share the parent's compiled definitions when processes are forked, and load the
+        compiled artifact once otherwise. Only a few chunks per worker are in flight at a time.
+
+        Args:
+            reports (iterable): The event report texts.
+            workers (int): The number of worker processes, 1 to classify in this process.
+            chunk_size (int): The number of reports sent to a worker at a time.
+
+        Yields:
+            list: The candidate (hazard code, keyword) tuples of each report, in input order.
+        """
+        if workers <= 1:
+            for report in reports:
+                yield self.classify_report(report)
+            return
+
+        global _worker_identifier
+        self.get_hazard_matcher()
+        _worker_identifier = self
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(start_method)
+        reports = iter(reports)
+        try:
+            with context.Pool(
+                workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.definitions_path,
+                    self.artifact_path,
+                    self.tokenizer,
+                    self.normalise,
+                ),
+            ) as pool:
+                pending = collections.deque()
+                for chunk in iter(lambda: list(itertools.islice(reports, chunk_size)), []):
+                    pending.append(pool.apply_async(_classify_chunk, (chunk,)))
+                    if len(pending) >= workers * 2:
+                        yield from pending.popleft().get()
+                while pending:
+                    yield from pending.popleft().get()
+        finally:
+            _worker_identifier = None
+
+    @staticmethod
+    def iter_reports(file_path, column="Report"):
+        """
+        Reads reports one at a time from a JSONL, CSV or xlsx file, so memory use does not grow
+        with the size of the file. A .json file must hold an array of report objects and is
+        loaded whole.
+
+        Args:
+            file_path (str): The path of the report file.
+            column (str): The column (or JSON key) holding the report text.
+
+        Yields:
+            str: The report texts, with missing reports as empty strings.
+        """
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension == ".jsonl":
+            with open(file_path, "r", encoding="UTF-8") as f:
+                for line in f:
+                    if line.strip():
+                        report = json.loads(line).get(column)
+                        yield "" if report is None else str(report)
+        elif extension == ".json":
+            with open(file_path, "r", encoding="UTF-8") as f:
+                reports = json.load(f)
+            if not isinstance(reports, list):
+                raise ValueError(f"Expected a JSON array of reports in {file_path}")
+            for record in reports:
+                report = record.get(column)
+                yield "" if report is None else str(report)
+        elif extension == ".csv":
+            # report bodies are often longer than the default csv field limit
+            csv.field_size_limit(sys.maxsize)
+            with open(file_path, "r", encoding="UTF-8", newline="") as f:
+                reader = csv.DictReader(f)
+                if column not in (reader.fieldnames or []):
+                    raise KeyError(f"Column {column} not found in {file_path}")
+                for row in reader:
+                    yield row[column] or ""
+        elif extension in [".xlsx", ".xlsm"]:
+            workbook = openpyxl.load_workbook(file_path, read_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = list(next(rows, []))
+                if column not in header:
+                    raise KeyError(f"Column {column} not found in {file_path}")
+                position = header.index(column)
+                for row in rows:
+                    report = row[position] if position < len(row) else None
+                    yield "" if report is None else str(report)
+            finally:
+                workbook.close()
+        else:
+            raise ValueError(f"Unsupported report file format: {extension}")
+
+    @staticmethod
+    def write_batch_results(results, output_path):
+        """
+        Writes the candidate hazards of each report as they are produced. JSONL and CSV rows are
+        flushed one at a time so partial output survives a crash, while a .json array is only
+        valid, and xlsx only written, once all reports are done.
+
+        Args:
+            results (iterable): The candidate (hazard code, keyword) tuples for each report.
+            output_path (str): The path of the output file.
+
+        Returns:
+            int: The number of reports written.
+        """
+        extension = os.path.splitext(output_path)[1].lower()
+        if extension not in [".jsonl", ".json", ".csv", ".xlsx"]:
+            raise ValueError(f"Unsupported output file format: {extension}")
+
+        columns = ["Report_Index", "Hazard_Codes", "Keywords"]
+        records = (
+            [
+                report_index,
+                ", ".join(code for code, _ in result),
+                ", ".join(word for _, word in result),
+            ]
+            for report_index, result in enumerate(results)
+        )
+
+        count = 0
+        if extension == ".xlsx":
+            workbook = openpyxl.Workbook(write_only=True)
+            worksheet = workbook.create_sheet()
+            worksheet.append(columns)
+            for record in records:
+                worksheet.append(record)
+                count += 1
+            workbook.save(output_path)
+            return count
+
+        with open(output_path, "w", encoding="UTF-8", newline="") as f:
+            if extension == ".csv":
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for record in records:
+                    writer.writerow(record)
+                    f.flush()
+                    count += 1
+            elif extension == ".jsonl":
+                for record in records:
+                    f.write(json.dumps(dict(zip(columns, record))) + "\n")
+                    f.flush()
+                    count += 1
+            else:
+                f.write("[")
+                for record in records:
+                    f.write(("," if count else "") + "\n" + json.dumps(dict(zip(columns, record))))
+                    f.flush()
+                    count += 1
+                f.write("\n]\n")
+        return count
+
+    def run_batch(self, input_path, output_path, column="Report", workers=1):
+        """
+        Executes the hazard identification process over a file of reports without user input,
+        streaming reports from the input file to the output file.
+
+        Args:
+            input_path (str): The path of the JSONL, JSON, CSV or xlsx report file.
+            output_path (str): The path of the JSONL, JSON, CSV or xlsx output file.
+            column (str): The column (or JSON key) holding the report text.
+            workers (int): The number of worker processes.
+
+        Returns:
+            int: The number of reports classified.
+        """
+        self.load_hazard_definitions()
+        results = self.classify_reports(self.iter_reports(input_path, column), workers=workers)
+        return self.write_batch_results(results, output_path)
+
     # def run(self):
     #     """
     #     Executes the hazard identification process (ReliefWeb max tagging version)
@@ -193,5 +888,39 @@ class HazardIdentifier:
 
 
 if __name__ == "__main__":
-    hazard_identifier = HazardIdentifier()
-    hazard_identifier.run()
+    parser = argparse.ArgumentParser(description="Rules-based hazard identification")
+    parser.add_argument(
+        "--batch", help="JSONL, JSON, CSV or xlsx file of reports to tag without prompts"
+    )
+    parser.add_argument("--output", default="batch_results.csv", help="output file for --batch")
+    parser.add_argument("--column", default="Report", help="column holding the report text")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of worker processes for --batch"
+    )
+    parser.add_argument(
+        "--definitions", default="../data/hazard_definitions.xlsx", help="hazard definitions file"
+    )
+    parser.add_argument("--artifact", help="compiled hazard definitions file")
+    parser.add_argument(
+        "--tokenizer",
+        choices=list(TOKENIZERS),
+        default="regex",
+        help="regex matches the API tokenizer, punkt uses nltk's word tokenizer",
+    )
+    parser.add_argument(
+        "--compile", action="store_true", help="compile the hazard definitions and exit"
+    )
+    parser.add_argument(
+        "--no-stemming", action="store_true", help="match keywords exactly, inflections included"
+    )
+    args = parser.parse_args()
+
+    hazard_identifier = HazardIdentifier(
+        args.definitions, args.artifact, args.tokenizer, not args.no_stemming
+    )
+    if args.compile:
+        hazard_identifier.compile_hazard_definitions()
+    elif args.batch:
+        hazard_identifier.run_batch(args.batch, args.output, args.column, args.workers)
+    else:
+        hazard_identifier.run()
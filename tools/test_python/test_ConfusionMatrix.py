@@ -0,0 +1,263 @@
+import os
+import zlib
+import json
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+from ConfusionMatrix.ConfusionMatrix import (
+    ConfusionMatrixGenerator,
+    EmbeddingCache,
+    EnsembleConfusionMatrixGenerator,
+    HazardEmbeddingIndex,
+    QuantizedEmbeddingStore,
+    chunked_top_k,
+    fuse_similarity_matrices,
+    parse_args,
+    read_table,
+    write_table,
+)
+
+
+class FakeModel:
+    """
+    Encodes each text to a fixed random vector, offset so that most pairs are similar.
+    """
+
+    def __init__(self):
+        self.encoded = []
+        self.kwargs = {}
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        self.kwargs = kwargs
+        embeddings = [
+            np.random.default_rng(zlib.crc32(text.encode())).normal(size=8)
+            + [3, 0, 0, 0, 0, 0, 0, 0]
+            for text in texts
+        ]
+        return np.array(embeddings, dtype=np.float32)
+
+
+class TestConfusionMatrixGenerator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hazard_df = pd.DataFrame(
+            {
+                "Hazard_Code": [f"H{i:02d}" for i in range(20)],
+                "Hazard_Category": ["A"] * 10 + ["B"] * 10,
+                "Hazard_Name": [f"Hazard {i}" for i in range(20)],
+                "Hazard_Description": [f"Description of hazard {i}" for i in range(20)],
+            }
+        )
+        self.data_file = os.path.join(self.tmp_dir.name, "hazard_definitions.csv")
+        write_table(self.hazard_df, self.data_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_generator(self, output_folder=None, **kwargs):
+        output_folder = output_folder or os.path.join(self.tmp_dir.name, "out")
+        os.makedirs(output_folder, exist_ok=True)
+        generator = ConfusionMatrixGenerator(
+            "fake-model", self.data_file, output_folder, output_format="csv", **kwargs
+        )
+        generator._model = FakeModel()
+        return generator
+
+    def test_import_does_not_load_model(self):
+        generator = ConfusionMatrixGenerator(
+            "fake-model", self.data_file, self.tmp_dir.name, output_format="csv"
+        )
+        self.assertIsNone(generator._model)
+
+    def test_read_write_table(self):
+        for extension in ["csv", "xlsx"]:
+            file_path = os.path.join(self.tmp_dir.name, f"table.{extension}")
+            write_table(self.hazard_df, file_path)
+            self.assertTrue(read_table(file_path).equals(self.hazard_df))
+
+    def test_select_top_confused(self):
+        generator = self.make_generator(top_k=2, threshold=0.5)
+        similarity_matrix = np.array([[1.0, 0.9, 0.6, 0.4], [0.9, 1.0, 0.7, 0.8]])
+        top_indices, top_scores = generator.select_top_confused(similarity_matrix)
+        np.testing.assert_array_equal(top_indices, [[1, 2], [0, 3]])
+        np.testing.assert_allclose(top_scores, [[0.9, 0.6], [0.9, 0.8]])
+
+    def test_chunked_top_k_matches_dense(self):
+        embeddings = FakeModel().encode([f"text {i}" for i in range(50)])
+        generator = self.make_generator(top_k=3)
+        expected, _ = generator.select_top_confused(cosine_similarity(embeddings))
+        top_indices, _ = chunked_top_k(
+            embeddings, embeddings, 3, chunk_size=7, min_score=0.5, max_score=1.0, exclude_self=True
+        )
+        np.testing.assert_array_equal(top_indices, expected)
+
+    def test_quantized_store_search(self):
+        embeddings = FakeModel().encode([f"text {i}" for i in range(200)])
+        for dtype, ratio in [("float16", 2), ("int8", 4)]:
+            path = os.path.join(self.tmp_dir.name, f"embeddings_{dtype}.npy")
+            QuantizedEmbeddingStore.create(path, embeddings, dtype, chunk_size=64)
+            store = QuantizedEmbeddingStore(path)
+            self.assertEqual(store.codes.dtype, np.dtype(dtype))
+            self.assertEqual(store.codes.nbytes * ratio, embeddings.nbytes)
+            top_indices, top_scores = store.search(embeddings[:5], top_k=1)
+            np.testing.assert_array_equal(top_indices[:, 0], np.arange(5))
+            np.testing.assert_allclose(top_scores[:, 0], 1, atol=1e-2)
+            self.assertGreater(store.recall(embeddings[:50], embeddings, top_k=5), 0.9)
+
+    def test_quantized_store_overwrites_dtype(self):
+        embeddings = FakeModel().encode([f"text {i}" for i in range(20)])
+        path = os.path.join(self.tmp_dir.name, "embeddings.npy")
+        QuantizedEmbeddingStore.create(path, embeddings, "int8")
+        store = QuantizedEmbeddingStore.create(path, embeddings, "float16")
+        self.assertIsNone(store.scales)
+        self.assertFalse(os.path.exists(QuantizedEmbeddingStore.scales_path(path)))
+        np.testing.assert_array_equal(store.search(embeddings, top_k=1)[0][:, 0], np.arange(20))
+
+    def test_run_writes_outputs(self):
+        generator = self.make_generator(top_k=3, threshold=0.0)
+        generator.run(heatmap=False)
+        output_folder = generator.output_folder
+        similarity_matrix = np.load(os.path.join(output_folder, "confusion_matrix.npy"))
+        self.assertEqual(similarity_matrix.shape, (20, 20))
+        definitions = read_table(os.path.join(output_folder, "hazard_definitions.csv"))
+        self.assertTrue(
+            all(len(confused.split(", ")) == 3 for confused in definitions["Confused_Hazards"])
+        )
+
+    def test_embeddings_cached(self):
+        generator = self.make_generator()
+        generator.encode_descriptions()
+        cached = self.make_generator()
+        cached.encode_descriptions()
+        self.assertEqual(cached._model.encoded, [])
+
+    def test_embedding_cache_ignores_unlisted_rows(self):
+        cache = EmbeddingCache(os.path.join(self.tmp_dir.name, "cache"), "fake-model")
+        model = FakeModel()
+        cache.get_embeddings(["a", "b"], model.encode)
+        # an interrupted write replaced the embeddings but not the manifest
+        np.save(cache.embeddings_path, model.encode(["a", "b", "c"]))
+        embeddings = cache.get_embeddings(["d", "a"], model.encode)
+        np.testing.assert_array_equal(embeddings, model.encode(["d", "a"]))
+        self.assertEqual(cache.load()[1].shape[0], 3)
+
+        np.save(cache.embeddings_path, model.encode(["a"]))
+        self.assertEqual(cache.load(), ([], None))
+
+    def test_encode_logs_throughput(self):
+        generator = self.make_generator(batch_size=4, normalize=True)
+        with self.assertLogs("ConfusionMatrix.ConfusionMatrix", level="INFO") as logs:
+            generator.encode_descriptions()
+        events = {
+            event["event"]: event
+            for event in (json.loads(record.getMessage()) for record in logs.records)
+        }
+        self.assertEqual(events["encode"]["sentences"], 20)
+        self.assertEqual(events["encode"]["batch_size"], 4)
+        self.assertIn("sentences_per_second", events["encode"])
+        self.assertIn("peak_rss_mb", events["encode_descriptions"])
+        self.assertEqual(generator._model.kwargs, {"batch_size": 4, "normalize_embeddings": True})
+
+    def test_run_incremental_matches_full_run(self):
+        self.make_generator(threshold=0.0).run(heatmap=False)
+        self.hazard_df.loc[5, "Hazard_Description"] = "An edited description"
+        write_table(self.hazard_df, self.data_file)
+
+        generator = self.make_generator(threshold=0.0)
+        changed = generator.run_incremental()
+        full = self.make_generator(os.path.join(self.tmp_dir.name, "full"), threshold=0.0)
+        full.run(heatmap=False)
+
+        incremental_definitions = read_table(f"{generator.output_folder}/hazard_definitions.csv")
+        full_definitions = read_table(f"{full.output_folder}/hazard_definitions.csv")
+        self.assertTrue(incremental_definitions.equals(full_definitions))
+        self.assertIn("H05", changed)
+        np.testing.assert_allclose(
+            np.load(f"{generator.output_folder}/confusion_matrix.npy"),
+            np.load(f"{full.output_folder}/confusion_matrix.npy"),
+            atol=1e-6,
+        )
+
+    def test_run_incremental_without_state_runs_full(self):
+        generator = self.make_generator(threshold=0.0)
+        changed = generator.run_incremental(heatmap=False)
+        self.assertEqual(changed, self.hazard_df["Hazard_Code"].tolist())
+        self.assertTrue(os.path.exists(f"{generator.output_folder}/confusion_matrix.npy"))
+
+    def test_fuse_similarity_matrices(self):
+        first = np.array([[1.0, 0.9, 0.6], [0.9, 1.0, 0.2], [0.6, 0.2, 1.0]])
+        second = np.array([[1.0, 0.5, 0.7], [0.5, 1.0, 0.4], [0.7, 0.4, 1.0]])
+        np.testing.assert_allclose(
+            fuse_similarity_matrices([first, second], "mean")[0], [1, 0.7, 0.65]
+        )
+        np.testing.assert_allclose(
+            fuse_similarity_matrices([first, second], "max")[0], [1, 0.9, 0.7]
+        )
+        fused = fuse_similarity_matrices([first, second], "rank")
+        np.testing.assert_allclose(
+            np.sort(fused, axis=1),
+            np.sort(fuse_similarity_matrices([first, second], "mean"), axis=1),
+        )
+        self.assertEqual(fused[0, 0], 1.0)
+
+    def test_ensemble_reports_agreement(self):
+        output_folder = os.path.join(self.tmp_dir.name, "out")
+        os.makedirs(output_folder)
+        generator = EnsembleConfusionMatrixGenerator(
+            ["fake-a", "fake-b"], self.data_file, output_folder, output_format="csv", threshold=0.0
+        )
+        for model_generator in generator.generators:
+            model_generator._model = FakeModel()
+            self.assertIs(model_generator.hazard_df, generator.hazard_df)
+        generator.compute_similarity_matrix()
+        self.assertFalse(os.path.exists(os.path.join(output_folder, "model_report.csv")))
+        generator.run(heatmap=False)
+
+        # both models encode identically, so they agree with the fused lists exactly
+        report = read_table(os.path.join(output_folder, "model_report.csv"))
+        self.assertEqual(report["Model"].tolist(), ["fake-a", "fake-b"])
+        self.assertEqual(report["Top_K_Exact"].tolist(), [1.0, 1.0])
+        # each model keeps its own embedding cache
+        cached = os.listdir(os.path.join(output_folder, "embeddings"))
+        self.assertEqual(len([name for name in cached if name.endswith(".npy")]), 2)
+
+    def test_ensemble_mean_embeddings(self):
+        output_folder = os.path.join(self.tmp_dir.name, "out")
+        os.makedirs(output_folder)
+        generator = EnsembleConfusionMatrixGenerator(
+            ["fake-a", "fake-b"], self.data_file, output_folder, output_format="csv", threshold=0.0
+        )
+        for model_generator in generator.generators:
+            model_generator._model = FakeModel()
+        embeddings = generator.encode_descriptions()
+        self.assertEqual(embeddings.shape, (20, 16))
+        np.testing.assert_allclose(
+            cosine_similarity(embeddings), generator.compute_similarity_matrix(), atol=1e-5
+        )
+
+        generator.fusion = "max"
+        with self.assertRaises(ValueError):
+            generator.encode_descriptions()
+
+    def test_embedding_index_classify(self):
+        generator = self.make_generator()
+        index = generator.build_embedding_index()
+        self.assertIsInstance(index, HazardEmbeddingIndex)
+        encode = FakeModel().encode
+        candidates = index.classify(["Description of hazard 7", ""], encode, top_k=2)
+        self.assertEqual(candidates[0][0], "H07")
+        self.assertAlmostEqual(candidates[0][1], 1.0, places=5)
+        self.assertEqual(len(candidates), 2)
+
+    def test_parse_args(self):
+        args = parse_args(["--top-k", "5", "--threshold", "0.6", "--device", "cpu"])
+        self.assertEqual((args.top_k, args.threshold, args.device), (5, 0.6, "cpu"))
+        self.assertEqual(args.mode, "full")
+        args = parse_args(["--model", "a", "b", "--mode", "chunked"])
+        self.assertEqual(args.fusion, "mean")
+        for argv in [["--mode", "incremental"], ["--quantize", "int8"]]:
+            with self.assertRaises(SystemExit):
+                parse_args(["--model", "a", "b", "--fusion", "max"] + argv)
@@ -1,8 +1,11 @@
+import os
+import json
 import unittest
 import itertools
+import tempfile
 from unittest.mock import patch
 import pandas as pd
-from RulesBased.rules_based import HazardIdentifier
+from RulesBased.rules_based import HazardIdentifier, HazardMatcher, HazardGraph, regex_tokenize
 
 
 class TestHazardIdentifier(unittest.TestCase):
@@ -231,6 +234,372 @@ class TestHazardIdentifier(unittest.TestCase):
         hazard_identifier.identify_hazards()
         self.assertEqual(hazard_identifier.identified_hazards, {"H1"})
 
+    @patch.object(HazardIdentifier, "tokenize_text", side_effect=lambda text: text.lower().split())
+    def test_classify_report(self, tokenize_text):
+        hazard_identifier = HazardIdentifier()
+        hazard_identifier.hazard_definitions_pd = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1", "H2", "H3"],
+                "Upstream_Hazards": [[], [], []],
+                "Keywords": [["keyword1"], ["keyword2", "keyword3"], ["keyword4"]],
+                "Questions": ["Question 1?", "Question 2?", "Question 3?"],
+                "Hazard_Name": ["Hazard 1", "Hazard 2", "Hazard 3"],
+                "Hazard_Description": ["Description 1", "Description 2", "Description 3"],
+            }
+        )
+        candidates = hazard_identifier.classify_report("Keyword3 and keyword1")
+        self.assertEqual(candidates, [("H1", "keyword1"), ("H2", "keyword3")])
+        self.assertIsNone(hazard_identifier.report)
+        self.assertEqual(hazard_identifier.identified_hazards, set())
+
+    @patch.object(HazardIdentifier, "tokenize_text", side_effect=lambda text: text.lower().split())
+    def test_run_batch(self, tokenize_text):
+        hazard_identifier = HazardIdentifier()
+        hazard_identifier.hazard_definitions_pd = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1", "H2"],
+                "Upstream_Hazards": [[], []],
+                "Keywords": [["keyword1"], ["keyword2"]],
+                "Questions": ["Question 1?", "Question 2?"],
+                "Hazard_Name": ["Hazard 1", "Hazard 2"],
+                "Hazard_Description": ["Description 1", "Description 2"],
+            }
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "reports.jsonl")
+            output_path = os.path.join(tmp_dir, "results.csv")
+            pd.DataFrame({"Report": ["keyword1 keyword2", None, "nothing"]}).to_json(
+                input_path, orient="records", lines=True
+            )
+            with patch.object(HazardIdentifier, "load_hazard_definitions"):
+                hazard_identifier.run_batch(input_path, output_path)
+            results_df = pd.read_csv(output_path, keep_default_na=False)
+
+        self.assertEqual(results_df["Hazard_Codes"].tolist(), ["H1, H2", "", ""])
+        self.assertEqual(results_df["Keywords"].tolist(), ["keyword1, keyword2", "", ""])
+
+    def test_iter_reports_unsupported(self):
+        with self.assertRaises(ValueError):
+            list(HazardIdentifier.iter_reports("reports.txt"))
+
+    def test_iter_reports(self):
+        reports_df = pd.DataFrame({"Id": [1, 2, 3], "Report": ["first, report", None, "third"]})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for extension in ["csv", "jsonl", "json", "xlsx"]:
+                input_path = os.path.join(tmp_dir, f"reports.{extension}")
+                if extension == "csv":
+                    reports_df.to_csv(input_path, index=False)
+                elif extension == "jsonl":
+                    reports_df.to_json(input_path, orient="records", lines=True)
+                elif extension == "json":
+                    reports_df.to_json(input_path, orient="records")
+                else:
+                    reports_df.to_excel(input_path, index=False)
+                self.assertEqual(
+                    list(HazardIdentifier.iter_reports(input_path)), ["first, report", "", "third"]
+                )
+                if extension not in ["jsonl", "json"]:
+                    with self.assertRaises(KeyError):
+                        list(HazardIdentifier.iter_reports(input_path, "Body"))
+
+    def test_write_batch_results_streaming(self):
+        def results():
+            yield [("H1", "keyword1"), ("H2", "keyword2")]
+            raise RuntimeError("worker crashed")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "results.jsonl")
+            with self.assertRaises(RuntimeError):
+                HazardIdentifier.write_batch_results(results(), output_path)
+            results_df = pd.read_json(output_path, lines=True)
+
+        self.assertEqual(results_df["Hazard_Codes"].tolist(), ["H1, H2"])
+
+    def test_write_batch_results_json_array(self):
+        results = [[("H1", "keyword1"), ("H2", "keyword2")], [], [("H3", "keyword3")]]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "results.json")
+            self.assertEqual(HazardIdentifier.write_batch_results(results, output_path), 3)
+            with open(output_path, "r", encoding="UTF-8") as f:
+                records = json.load(f)
+
+        self.assertEqual([record["Hazard_Codes"] for record in records], ["H1, H2", "", "H3"])
+
+    def test_hazard_matcher_match(self):
+        hazard_matcher = HazardMatcher(
+            pd.DataFrame(
+                {
+                    "Hazard_Code": ["H1", "H2", "H3"],
+                    "Keywords": [["flood", "flash flood"], ["flash flood", "rain"], ["ice"]],
+                }
+            )
+        )
+        report = ["heavy", "rain", "caused", "a", "flash", "flood"]
+        self.assertEqual(hazard_matcher.match(report), [("H1", "flood"), ("H2", "flash flood")])
+        self.assertEqual(hazard_matcher.match(["flash", "rain"]), [("H2", "rain")])
+        self.assertEqual(hazard_matcher.match([]), [])
+
+    @patch("builtins.input", side_effect=itertools.cycle(["y"]))
+    def test_identify_multi_word_keyword(self, input):
+        hazard_identifier = HazardIdentifier()
+        hazard_identifier.hazard_definitions_pd = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1", "H2"],
+                "Upstream_Hazards": [[], []],
+                "Keywords": [["black ice"], ["ice storm"]],
+                "Questions": ["Question 1?", "Question 2?"],
+                "Hazard_Name": ["Hazard 1", "Hazard 2"],
+                "Hazard_Description": ["Description 1", "Description 2"],
+            }
+        )
+        hazard_identifier.report = ["black", "ice", "after", "the", "storm"]
+        hazard_identifier.identify_hazards()
+        self.assertEqual(hazard_identifier.identified_hazards, {"H1"})
+
+    def test_compiled_definitions_cache(self):
+        definitions_df = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1", "H2"],
+                "Hazard_Name": ["Hazard 1", "Hazard 2"],
+                "Hazard_Description": ["Description 1", "Description 2"],
+                "Upstream_Hazards": [None, "H1"],
+                "Keywords": ["keyword1, flash flood", None],
+                "Questions": ["Question 1?", "Question 2?"],
+            }
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            definitions_path = os.path.join(tmp_dir, "hazard_definitions.xlsx")
+            definitions_df.to_excel(definitions_path, index=False)
+            hazard_identifier = HazardIdentifier(definitions_path)
+            hazard_identifier.load_hazard_definitions()
+            self.assertTrue(os.path.exists(hazard_identifier.artifact_path))
+            self.assertEqual(
+                hazard_identifier.hazard_definitions_pd["Keywords"].tolist(),
+                [["keyword1", "flash flood"], []],
+            )
+            self.assertEqual(
+                hazard_identifier.hazard_definitions_pd["Upstream_Hazards"].tolist(), [[], ["H1"]]
+            )
+
+            with patch.object(
+                HazardIdentifier, "compile_hazard_definitions"
+            ) as compile_definitions:
+                HazardIdentifier(definitions_path).load_hazard_definitions()
+                compile_definitions.assert_not_called()
+
+            definitions_df.loc[1, "Keywords"] = "keyword2"
+            definitions_df.to_excel(definitions_path, index=False)
+            hazard_identifier.load_hazard_definitions()
+            self.assertEqual(
+                hazard_identifier.hazard_definitions_pd["Keywords"].tolist(),
+                [["keyword1", "flash flood"], ["keyword2"]],
+            )
+
+    def test_compiled_definitions_without_source(self):
+        definitions_df = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1"],
+                "Upstream_Hazards": [None],
+                "Keywords": ["keyword1"],
+                "Synonyms": [None],
+            }
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            definitions_path = os.path.join(tmp_dir, "hazard_definitions.xlsx")
+            definitions_df.to_excel(definitions_path, index=False)
+            hazard_identifier = HazardIdentifier(definitions_path)
+            hazard_identifier.compile_hazard_definitions()
+            self.assertEqual(os.listdir(tmp_dir).count("hazard_definitions.compiled.json"), 1)
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+            os.remove(definitions_path)
+
+            hazard_identifier.load_hazard_definitions()
+            self.assertEqual(hazard_identifier.classify_report("keyword1"), [("H1", "keyword1")])
+            with self.assertRaises(ValueError):
+                HazardIdentifier(definitions_path, tokenizer="punkt").load_hazard_definitions()
+
+            with open(hazard_identifier.artifact_path, "r", encoding="UTF-8") as f:
+                artifact = json.load(f)
+            artifact["version"] = 1
+            with open(hazard_identifier.artifact_path, "w", encoding="UTF-8") as f:
+                json.dump(artifact, f)
+            with self.assertRaises(ValueError):
+                hazard_identifier.load_hazard_definitions()
+
+    @patch("builtins.input", side_effect=itertools.cycle(["y"]))
+    def test_upstream_hazards_deep_cascade(self, input):
+        hazard_identifier = HazardIdentifier()
+        hazard_identifier.hazard_definitions_pd = pd.DataFrame(
+            {
+                "Hazard_Code": ["H4", "H3", "H2", "H1", "H5"],
+                "Upstream_Hazards": [["H3"], ["H2"], ["H1"], [], []],
+                "Keywords": [[], [], [], ["keyword1"], ["keyword5"]],
+                "Questions": [
+                    "Question 4?",
+                    "Question 3?",
+                    "Question 2?",
+                    "Question 1?",
+                    "Question 5?",
+                ],
+                "Hazard_Name": ["Hazard 4", "Hazard 3", "Hazard 2", "Hazard 1", "Hazard 5"],
+                "Hazard_Description": ["D4", "D3", "D2", "D1", "D5"],
+            }
+        )
+        hazard_identifier.report = ["keyword1"]
+        hazard_identifier.identify_hazards()
+        self.assertEqual(hazard_identifier.identified_hazards, {"H1", "H2", "H3", "H4"})
+        # one question per hazard plus the final confirmation
+        self.assertEqual(input.call_count, 5)
+
+    def test_hazard_graph_order(self):
+        hazard_graph = HazardGraph({"H3": ["H2"], "H2": ["H1", "H2"], "H1": [], "H4": ["H9"]})
+        self.assertEqual(hazard_graph.downstream, {"H3": [], "H2": ["H3"], "H1": ["H2"], "H4": []})
+        self.assertLess(hazard_graph.order["H1"], hazard_graph.order["H2"])
+        self.assertLess(hazard_graph.order["H2"], hazard_graph.order["H3"])
+        self.assertEqual(hazard_graph.cycles, [])
+
+    def test_hazard_graph_cycle(self):
+        with self.assertWarns(UserWarning):
+            hazard_graph = HazardGraph({"H1": ["H2"], "H2": ["H1"], "H3": []})
+        self.assertEqual(hazard_graph.cycles, ["H1", "H2"])
+        self.assertEqual(len(hazard_graph.order), 3)
+
+    def test_hazard_matcher_operators(self):
+        hazard_matcher = HazardMatcher(
+            pd.DataFrame(
+                {
+                    "Hazard_Code": ["H1", "H2", "H3"],
+                    "Keywords": [["ocean", "acidification", "coral"], ["ocean"], ["flood"]],
+                    "Keywords_Operator": ["AND", "AND", None],
+                }
+            )
+        )
+        self.assertEqual(
+            hazard_matcher.match(["ocean", "flood"]), [("H2", "ocean"), ("H3", "flood")]
+        )
+        self.assertEqual(
+            hazard_matcher.match(["coral", "ocean"]), [("H1", "ocean"), ("H2", "ocean")]
+        )
+
+    def test_hazard_matcher_exclusions(self):
+        hazard_matcher = HazardMatcher(
+            pd.DataFrame(
+                {
+                    "Hazard_Code": ["H1", "H2", "H3"],
+                    "Keywords": [["fog", "mist"], ["haze", "smoke", "mist"], ["mist"]],
+                    "Excluded_Hazards": [["H2"], ["H1"], []],
+                }
+            )
+        )
+        self.assertEqual(hazard_matcher.match(["haze", "mist"]), [("H2", "haze"), ("H3", "mist")])
+        self.assertEqual(hazard_matcher.match(["fog", "haze"]), [("H1", "fog"), ("H2", "haze")])
+
+    def test_hazard_matcher_one_way_exclusion(self):
+        hazard_matcher = HazardMatcher(
+            pd.DataFrame(
+                {
+                    "Hazard_Code": ["COLD", "HEAT"],
+                    "Keywords": [["cold", "frost", "freeze"], ["heat"]],
+                    "Excluded_Hazards": [["HEAT"], []],
+                }
+            )
+        )
+        self.assertEqual(
+            hazard_matcher.match(["cold", "frost", "freeze", "heat"]), [("COLD", "cold")]
+        )
+        self.assertEqual(
+            hazard_matcher.match(["heat", "cold"]), [("COLD", "cold"), ("HEAT", "heat")]
+        )
+
+    @patch.object(HazardIdentifier, "tokenize_text", side_effect=lambda text: text.lower().split())
+    def test_classify_reports_workers(self, tokenize_text):
+        hazard_identifier = HazardIdentifier()
+        hazard_identifier.hazard_definitions_pd = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1", "H2"],
+                "Upstream_Hazards": [[], []],
+                "Keywords": [["keyword1"], ["keyword2"]],
+                "Questions": ["Question 1?", "Question 2?"],
+                "Hazard_Name": ["Hazard 1", "Hazard 2"],
+                "Hazard_Description": ["Description 1", "Description 2"],
+            }
+        )
+        reports = [f"report keyword{i % 3}" for i in range(50)]
+        expected = list(hazard_identifier.classify_reports(reports))
+        results = list(hazard_identifier.classify_reports(iter(reports), workers=2, chunk_size=7))
+        self.assertEqual(results, expected)
+        self.assertEqual(results[:3], [[], [("H1", "keyword1")], [("H2", "keyword2")]])
+
+    def test_regex_tokenize(self):
+        # matches natural.WordTokenizer, used by the API
+        self.assertEqual(
+            regex_tokenize("She said 'hello'. Cloud-to-ground, 10km_radius!"),
+            ["She", "said", "hello", "Cloud", "to", "ground", "10km_radius"],
+        )
+
+    @patch("RulesBased.rules_based.nltk.download")
+    def test_no_download_on_init(self, download):
+        hazard_identifier = HazardIdentifier()
+        hazard_identifier.tokenize_text("Flash flooding")
+        download.assert_not_called()
+        with self.assertRaises(ValueError):
+            HazardIdentifier(tokenizer="whitespace")
+
+    def test_hazard_matcher_normalised(self):
+        hazard_definitions = pd.DataFrame(
+            {
+                "Hazard_Code": ["H1", "H2"],
+                "Keywords": [["flood", "river"], ["ice"]],
+                "Synonyms": [["flash flooding"], []],
+            }
+        )
+        hazard_matcher = HazardMatcher(hazard_definitions)
+        self.assertEqual(hazard_matcher.match(["rivers", "flooded"]), [("H1", "flood")])
+        self.assertEqual(hazard_matcher.match(["flash", "floods"]), [("H1", "flood")])
+        self.assertEqual(hazard_matcher.match(["flashes", "iceberg"]), [])
+
+        hazard_matcher = HazardMatcher(hazard_definitions, normalise=False)
+        self.assertEqual(hazard_matcher.match(["floods"]), [])
+        self.assertEqual(hazard_matcher.match(["flash", "flooding"]), [("H1", "flash flooding")])
+
+    def test_hazard_matcher_keeps_derivations_apart(self):
+        hazard_matcher = HazardMatcher(
+            pd.DataFrame({"Hazard_Code": ["H1", "H2"], "Keywords": [["aids"], ["organic"]]})
+        )
+        self.assertEqual(hazard_matcher.match(["aid", "organization", "organizations"]), [])
+        self.assertEqual(hazard_matcher.match(["aids"]), [("H1", "aids")])
+
+    def test_classify_report_shipped_definitions(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            hazard_identifier = HazardIdentifier(
+                "data/hazard_definitions.xlsx", os.path.join(tmp_dir, "definitions.json")
+            )
+            hazard_identifier.load_hazard_definitions()
+        self.assertEqual(
+            hazard_identifier.classify_report(
+                "Humanitarian aid organizations reached the district."
+            ),
+            [],
+        )
+        self.assertIn(("MH0004", "flood"), hazard_identifier.classify_report("Flooding spread."))
+        # Synonyms cells with citations, such as "(WMO, 2021)", must not index the year
+        self.assertEqual(
+            hazard_identifier.classify_report("The 2021 and 1992 figures"),
+            [],
+        )
+        synonyms = hazard_identifier.hazard_definitions_pd.set_index("Hazard_Code")["Synonyms"]
+        self.assertIn("tropical cyclone", synonyms["MH0058"])
+        self.assertNotIn("it can be designated as a hurricane", synonyms["MH0058"])
+
+    def test_tokenize_synonyms(self):
+        self.assertEqual(
+            HazardIdentifier().tokenize_synonyms(
+                "Peak ground acceleration (PGA), Earth tremor, 2021, "
+                "it can be designated as a hurricane, hospital waste (Rutala and Mayhall, 1992)"
+            ),
+            ["peak ground acceleration", "earth tremor", "hospital waste"],
+        )
+
 
 # if __name__ == "__main__":
 #     unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Benchmarks the rules-based HazardIdentifier hot path.
+
+Measures hazard definition load time (compiling from Excel and loading the cached artifact),
+per-report match latency across report sizes, batch throughput against worker count, and peak
+memory, using data/eventReport.txt and a generated corpus.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+os.chdir(f"{script_dir}/..")
+sys.path.insert(0, os.getcwd())
+
+from RulesBased.rules_based import HazardIdentifier  # noqa: E402
+
+DEFINITIONS_PATH = "data/hazard_definitions.xlsx"
+EVENT_REPORT_PATH = "data/eventReport.txt"
+
+
+def generate_report(vocabulary, keywords, length, rng):
+    """
+    Generates a synthetic report of roughly `length` words, with about one word in fifty taken
+    from the hazard keywords.
+
+    Args:
+        vocabulary (list): Filler words to draw from.
+        keywords (list): Hazard keyword phrases to sprinkle in.
+        length (int): The number of words in the report.
+        rng (random.Random): The random number generator.
+
+    Returns:
+        str: The generated report.
+    """
+    words = [
+        rng.choice(keywords) if rng.random() < 0.02 else rng.choice(vocabulary)
+        for _ in range(length)
+    ]
+    return " ".join(words)
+
+
+def time_call(function, repeat):
+    """
+    Returns the median wall time of calling `function` `repeat` times, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def benchmark_load(artifact_path, repeat):
+    """
+    Benchmarks compiling the definitions from Excel and loading the compiled artifact.
+    """
+    results = {}
+
+    def compile_definitions():
+        if os.path.exists(artifact_path):
+            os.remove(artifact_path)
+        HazardIdentifier(DEFINITIONS_PATH, artifact_path).load_hazard_definitions()
+
+    results["load_compile_s"] = time_call(compile_definitions, repeat)
+    results["load_cached_s"] = time_call(
+        lambda: HazardIdentifier(DEFINITIONS_PATH, artifact_path).load_hazard_definitions(), repeat
+    )
+    return results
+
+
+def benchmark_latency(hazard_identifier, reports_by_size, repeat):
+    """
+    Benchmarks classify_report on single reports of each size.
+    """
+    return {
+        f"latency_{size}_words_ms": 1000
+        * time_call(lambda: hazard_identifier.classify_report(report), repeat)
+        for size, report in reports_by_size.items()
+    }
+
+
+def benchmark_throughput(hazard_identifier, corpus, worker_counts):
+    """
+    Benchmarks classify_reports over the corpus for each worker count.
+    """
+    results = {}
+    for workers in worker_counts:
+        start = time.perf_counter()
+        count = sum(1 for _ in hazard_identifier.classify_reports(corpus, workers=workers))
+        results[f"throughput_{workers}_workers_reports_per_s"] = count / (
+            time.perf_counter() - start
+        )
+    return results
+
+
+def benchmark_memory(hazard_identifier, corpus):
+    """
+    Measures the peak Python heap while classifying the corpus, and the process peak RSS.
+    """
+    tracemalloc.start()
+    for _ in hazard_identifier.classify_reports(corpus):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        max_rss //= 1024
+    return {"classify_peak_heap_mb": peak / 2**20, "peak_rss_mb": max_rss / 1024}
+
+
+parser = argparse.ArgumentParser(description="Benchmark the rules-based hazard identifier")
+
+parser.add_argument("--reports", type=int, default=2000, help="size of the generated corpus")
+parser.add_argument("--report-words", type=int, default=500, help="words per generated report")
+parser.add_argument(
+    "--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="report sizes for latency"
+)
+parser.add_argument(
+    "--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts for throughput"
+)
+parser.add_argument("--repeat", type=int, default=5, help="repetitions per timing")
+parser.add_argument("--seed", type=int, default=0, help="seed for the generated corpus")
+parser.add_argument("--output", help="also write the results to this JSON file")
+
+args = parser.parse_args()
+
+with open(EVENT_REPORT_PATH, "r", encoding="UTF-8") as f:
+    event_report = f.read()
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    artifact_path = os.path.join(tmp_dir, "hazard_definitions.compiled.json")
+    results = benchmark_load(artifact_path, args.repeat)
+
+    hazard_identifier = HazardIdentifier(DEFINITIONS_PATH, artifact_path)
+    hazard_identifier.load_hazard_definitions()
+
+vocabulary = hazard_identifier.tokenize_text(event_report)
+keywords = hazard_identifier.get_hazard_matcher().keyword_index.keywords
+rng = random.Random(args.seed)
+reports_by_size = {"event_report": event_report}
+reports_by_size.update(
+    {size: generate_report(vocabulary, keywords, size, rng) for size in args.sizes}
+)
+corpus = [
+    generate_report(vocabulary, keywords, args.report_words, rng) for _ in range(args.reports)
+]
+
+results.update(benchmark_latency(hazard_identifier, reports_by_size, args.repeat))
+results.update(benchmark_throughput(hazard_identifier, corpus, args.workers))
+results.update(benchmark_memory(hazard_identifier, corpus))
+
+for name, value in results.items():
+    print(f"{name:<45}{value:>12.3f}")
+
+if args.output:
+    with open(args.output, "w", encoding="UTF-8") as f:
+        json.dump(results, f, indent=2)